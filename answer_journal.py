@@ -0,0 +1,230 @@
+"""Журнал ответов и шагов с отложенной пакетной записью.
+
+Нажатия на варианты и переходы между вопросами копятся в памяти и
+схлопываются: выбор и снятие одного и того же варианта до записи в БД
+взаимно уничтожаются, из нескольких переходов остаётся последний шаг.
+Накопленное сбрасывается раз в flush_interval секунд (или при переполнении):
+изменения одной заявки — ответы и шаг — пишутся одним запросом COMMIT_STEP_SQL,
+заявки разных пользователей — одним executemany в транзакции. Если пачка
+отвергнута из-за данных (PERMANENT_ERRORS: заявка удалена, нарушено
+ограничение), заявки пишутся по одной, каждая под своей точкой сохранения, а
+не прошедшие и так логируются и отбрасываются — чтобы одна плохая заявка не
+стопорила запись остальных. При временных ошибках (обрыв соединения,
+deadlock) изменения возвращаются в очередь и повторяются. Перед чтением ответов или шага пользователя (продолжение анкеты,
+завершение, отчёт) вызывается flush_user — синхронный сброс его изменений,
+дожидающийся и уже идущей фоновой записи.
+"""
+import asyncio
+import logging
+
+import asyncpg
+
+ADD = 'add'
+REMOVE = 'remove'
+
+# Ошибки, которые не пройдут и при повторе: заявка удалена (FK), NOT NULL, неверные данные.
+# Остальные (deadlock, сбой сериализации, обрыв соединения) — изменения возвращаются в очередь
+PERMANENT_ERRORS = (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError)
+
+# Один серверный шаг: удалить/добавить ответы и сдвинуть шаг заявки.
+# Заявка адресуется по id (request_id), без подзапроса MAX(step_time).
+# $1 id_telegram, $2 request_id, $3/$4 — удаляемые (шаг, текст),
+# $5..$8 — добавляемые (логин, шаг, текст, тип), $9 — новый last_step или NULL.
+COMMIT_STEP_SQL = """
+    WITH removed AS (
+        DELETE FROM user_answers a
+        USING unnest($3::int[], $4::text[]) AS d(question_step, answer_text)
+        WHERE a.id_telegram = $1 AND a.request_id = $2
+          AND a.question_step = d.question_step AND a.answer_text = d.answer_text
+    ), added AS (
+        INSERT INTO user_answers (
+            id_telegram, tg_login, request_id, question_step, answer_text, answer_type, root
+        )
+        SELECT $1, i.tg_login, $2, i.question_step, i.answer_text, i.answer_type,
+               (SELECT root FROM users_designer WHERE id_telegram = $1)
+        FROM unnest($5::text[], $6::int[], $7::text[], $8::text[])
+             AS i(tg_login, question_step, answer_text, answer_type)
+    ), moved AS (
+        UPDATE users_designer SET last_step = $9::int
+        WHERE id_telegram = $1 AND $9::int IS NOT NULL
+    )
+    UPDATE data_questions SET step_number = $9::int, step_time = CURRENT_TIMESTAMP
+    WHERE id = $2 AND $9::int IS NOT NULL
+"""
+
+
+class AnswerJournal:
+    def __init__(self, pool, flush_interval=1.0, max_pending=1000):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # user_id -> {(request_id, question_step, answer_text): (op, tg_login, answer_type)}
+        self._pending = {}
+        # user_id -> (request_id, last_step)
+        self._steps = {}
+        self._count = 0
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._wakeup = None
+
+    @property
+    def pending(self):
+        return self._count + len(self._steps)
+
+    def _apply(self, user_id, key, entry):
+        ops = self._pending.setdefault(user_id, {})
+        previous = ops.get(key)
+        if previous is not None and previous[0] != entry[0]:
+            # add+remove (или remove+add) одной строки до записи — ничего не делать
+            del ops[key]
+            self._count -= 1
+            if not ops:
+                del self._pending[user_id]
+            return
+        if previous is None:
+            self._count += 1
+        ops[key] = entry
+
+    def add(self, user_id, tg_login, request_id, question_step, answer_text, answer_type):
+        if request_id is None:
+            # Заявки ещё нет (например, номер телефона не получен) — писать некуда
+            logging.warning(f"Ответ пользователя {user_id} без заявки отброшен: шаг {question_step}")
+            return
+        self._apply(user_id, (request_id, question_step, answer_text), (ADD, tg_login, answer_type))
+        self._kick()
+
+    def remove(self, user_id, request_id, question_step, answer_text):
+        self._apply(user_id, (request_id, question_step, answer_text), (REMOVE, None, None))
+        self._kick()
+
+    def set_step(self, user_id, request_id, last_step):
+        """Запомнить шаг пользователя; при сбросе запишется вместе с ответами."""
+        self._steps[user_id] = (request_id, last_step)
+        self._kick()
+
+    def has_pending(self, user_id):
+        return user_id in self._pending or user_id in self._steps
+
+    def discard_user(self, user_id):
+        """Забыть несохранённые изменения пользователя (например, при /reset)."""
+        self._count -= len(self._pending.pop(user_id, {}))
+        self._steps.pop(user_id, None)
+
+    def _kick(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if self.pending >= self.max_pending:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка записи ответов в БД: {e}")
+
+    async def flush_user(self, user_id):
+        """Записать изменения одного пользователя прямо сейчас.
+
+        Вызывается и без накопленных изменений: _flush берёт блокировку и тем
+        самым дожидается фоновой записи, которая могла уже забрать его изменения.
+        """
+        await self._flush([user_id])
+
+    async def flush(self):
+        """Записать все накопленные изменения."""
+        if self._pending or self._steps:
+            await self._flush(set(self._pending) | set(self._steps))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    @staticmethod
+    def build_commit_args(user_id, ops, step):
+        """Параметры COMMIT_STEP_SQL по заявкам пользователя.
+
+        ops — {(request_id, шаг, текст): (op, логин, тип)}, step — (request_id, last_step) или None.
+        """
+        groups = {}
+        for (request_id, question_step, text), (op, tg_login, answer_type) in ops.items():
+            group = groups.setdefault(request_id, ([], [], [], [], [], [], None))
+            if op == ADD:
+                group[2].append(tg_login)
+                group[3].append(question_step)
+                group[4].append(text)
+                group[5].append(answer_type)
+            else:
+                group[0].append(question_step)
+                group[1].append(text)
+        if step is not None:
+            request_id, last_step = step
+            group = groups.get(request_id, ([], [], [], [], [], [], None))
+            groups[request_id] = group[:6] + (last_step,)
+        return [(user_id, request_id) + group for request_id, group in groups.items()]
+
+    async def _flush(self, user_ids):
+        async with self._lock:
+            batch = {uid: self._pending.pop(uid) for uid in user_ids if uid in self._pending}
+            steps = {uid: self._steps.pop(uid) for uid in user_ids if uid in self._steps}
+            if not batch and not steps:
+                return
+            self._count -= sum(len(ops) for ops in batch.values())
+            args = []
+            for user_id in set(batch) | set(steps):
+                args.extend(self.build_commit_args(user_id, batch.get(user_id, {}), steps.get(user_id)))
+            try:
+                async with self.pool.acquire() as connection:
+                    if len(args) == 1:
+                        try:
+                            await connection.execute(COMMIT_STEP_SQL, *args[0])
+                        except PERMANENT_ERRORS as e:
+                            self._drop(args[0], e)
+                    else:
+                        async with connection.transaction():
+                            try:
+                                async with connection.transaction():
+                                    await connection.executemany(COMMIT_STEP_SQL, args)
+                            except PERMANENT_ERRORS as e:
+                                logging.warning(f"Пакет ответов отвергнут ({e}), пишем заявки по одной")
+                                await self._commit_each(connection, args)
+            except Exception:
+                # Возвращаем неудавшиеся изменения; более свежие нажатия применяются поверх
+                newer, self._pending = self._pending, {}
+                self._count = 0
+                for source in (batch, newer):
+                    for user_id, ops in source.items():
+                        for key, entry in ops.items():
+                            self._apply(user_id, key, entry)
+                for user_id, step in steps.items():
+                    self._steps.setdefault(user_id, step)
+                raise
+
+    @staticmethod
+    def _drop(row, error):
+        logging.error(f"Изменения заявки {row[1]} пользователя {row[0]} отброшены: {error}")
+
+    @classmethod
+    async def _commit_each(cls, connection, args):
+        """Записать заявки по одной, каждую под своей точкой сохранения.
+
+        Отвергнутые базой заявки (удалена, нарушено ограничение) логируются и
+        отбрасываются; остальные фиксируются внешней транзакцией. Временная
+        ошибка (обрыв соединения, deadlock) откатывает всё, и пачка целиком
+        возвращается в очередь.
+        """
+        for row in args:
+            try:
+                async with connection.transaction():
+                    await connection.execute(COMMIT_STEP_SQL, *row)
+            except PERMANENT_ERRORS as e:
+                cls._drop(row, e)
@@ -0,0 +1,55 @@
+"""Микро-бенчмарк callback_data кнопок-вариантов.
+
+Сравнивает прежний путь (truncate_text при построении клавиатуры и перебор
+вариантов с повторной обрезкой при нажатии) с индексной схемой
+"a:<вопрос>:<вариант>" и готовой таблицей разбора.
+
+    python bench/bench_callbacks.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from questionnaire import compile_questionnaire, truncate_text  # noqa: E402
+
+
+def legacy_encode(questions, step):
+    return [f"answer:{step}:{truncate_text(text, 62 - len(f'answer:{step}:'))}" for text in questions.option_texts[step]]
+
+
+def legacy_decode(questions, data):
+    parts = data.split(':')
+    step, truncated = int(parts[1]), parts[2]
+    return step, next((text for text in questions.option_texts[step] if truncate_text(text, 62 - len(f'answer:{step}:')) == truncated), truncated)
+
+
+def indexed_encode(questions, step):
+    return [questions.answer_callback(step, i) for i in range(len(questions.option_texts[step]))]
+
+
+def main():
+    questions = compile_questionnaire()
+    steps = [i for i in range(len(questions)) if questions.option_texts[i]]
+    legacy_payloads = [p for step in steps for p in legacy_encode(questions, step)]
+    indexed_payloads = [p for step in steps for p in indexed_encode(questions, step)]
+    clicks = len(legacy_payloads)
+
+    def run(label, func, number, per):
+        total = min(timeit.repeat(func, number=number, repeat=5))
+        print(f"{label:<40} {total / (number * per) * 1e6:8.2f} мкс/{'клавиатуру' if per == len(steps) else 'нажатие'}")
+
+    print(f"Вопросов с вариантами: {len(steps)}, кнопок: {clicks}")
+    run("encode: truncate_text (старый)", lambda: [legacy_encode(questions, s) for s in steps], 50, len(steps))
+    run("encode: a:<q>:<opt>", lambda: [indexed_encode(questions, s) for s in steps], 50, len(steps))
+    run("decode: перебор + truncate (старый)", lambda: [legacy_decode(questions, p) for p in legacy_payloads], 20, clicks)
+    run("decode: a:<q>:<opt>", lambda: [questions.decode_answer_callback(p) for p in indexed_payloads], 20, clicks)
+    run("decode: старый payload через таблицу", lambda: [questions.decode_answer_callback(p) for p in legacy_payloads], 20, clicks)
+
+    # Совместимость: новый путь разбирает старые payload так же, как старый
+    assert all(legacy_decode(questions, p)[1] == questions.decode_answer_callback(p)[1] for p in legacy_payloads if p.count(':') == 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Бенчмарк выбора обработчика: цепочка фильтров aiogram против TableRouter.
+
+Оба диспетчера получают одинаковый набор обработчиков, как в main.py
+(обработчики пустые — меряется только маршрутизация), и одну и ту же смесь
+обновлений: кнопки меню, нажатия вариантов в анкете, свой ответ текстом.
+Состояние — MemoryStorage, без Telegram и БД.
+
+    python bench/bench_router.py
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, types  # noqa: E402
+from aiogram.contrib.fsm_storage.memory import MemoryStorage  # noqa: E402
+from aiogram.dispatcher.filters import Text  # noqa: E402
+from aiogram.dispatcher.filters.state import State, StatesGroup  # noqa: E402
+
+from router import TableRouter  # noqa: E402
+
+UPDATES = int(os.getenv('BENCH_UPDATES', '20000'))
+
+
+class Form(StatesGroup):
+    waiting_for_phone = State()
+
+
+class Questionnaire(StatesGroup):
+    asking = State()
+    custom_answer = State()
+
+
+class Manual(StatesGroup):
+    waiting_for_user_id = State()
+
+
+async def noop(*args, **kwargs):
+    pass
+
+
+def build_chain(dp):
+    """Регистрация как в main.py до TableRouter."""
+    dp.register_message_handler(noop, commands=['menu'])
+    dp.register_message_handler(noop, lambda message: message.text.lower() == 'меню')
+    dp.register_callback_query_handler(noop, lambda c: c.data == "check_sub")
+    dp.register_message_handler(noop, commands='start')
+    dp.register_message_handler(noop, commands=['portfolio'])
+    dp.register_message_handler(noop, lambda message: message.text == "Портфолио")
+    dp.register_callback_query_handler(noop, lambda c: c.data in ['portfolio_next', 'portfolio_prev', 'portfolio_close'])
+    dp.register_message_handler(noop, commands=['reset'])
+    dp.register_message_handler(noop, commands=['help'])
+    dp.register_message_handler(noop, lambda message: message.text.lower() == "хелпер")
+    dp.register_message_handler(noop, commands=['contacts'])
+    dp.register_message_handler(noop, lambda message: message.text == "Контакты")
+    dp.register_message_handler(noop, commands=['GO'])
+    dp.register_message_handler(noop, lambda message: message.text == "Начать", state='*')
+    dp.register_message_handler(noop, content_types=types.ContentTypes.CONTACT, state=Form.waiting_for_phone)
+    dp.register_message_handler(noop, lambda message: message.text == "Нет", state=Form.waiting_for_phone)
+    dp.register_message_handler(noop, lambda message: message.text == "Продолжить", state='*')
+    dp.register_callback_query_handler(noop, lambda c: c.data.startswith("brakepoint"))
+    dp.register_message_handler(noop, state=Questionnaire.custom_answer)
+    dp.register_callback_query_handler(noop, text="custom_answer", state=Questionnaire.asking)
+    dp.register_callback_query_handler(noop, lambda c: c.data == 'nav:interrupt', state=Questionnaire.asking)
+    dp.register_message_handler(noop, state=Questionnaire.asking, content_types=types.ContentTypes.TEXT)
+    dp.register_callback_query_handler(noop, Text(startswith=["a:", "answer:", "nav:", "brakepoint:"]), state=Questionnaire.asking)
+    dp.register_message_handler(noop, commands=['check_sub_debug'])
+    dp.register_message_handler(noop, commands=['manual'])
+    dp.register_message_handler(noop, state=Manual.waiting_for_user_id, content_types=types.ContentTypes.TEXT)
+
+
+def build_table(dp):
+    """Те же обработчики через TableRouter (как в main.py сейчас)."""
+    router = TableRouter(dp)
+    router.install()
+    router.message_handler(commands='menu', text_lower='меню')(noop)
+    router.callback_query_handler(data="check_sub")(noop)
+    router.message_handler(commands='start')(noop)
+    router.message_handler(commands='portfolio', text="Портфолио")(noop)
+    router.callback_query_handler(data=['portfolio_next', 'portfolio_prev', 'portfolio_close'])(noop)
+    router.message_handler(commands='reset')(noop)
+    router.message_handler(commands='help', text_lower="хелпер")(noop)
+    router.message_handler(commands='contacts', text="Контакты")(noop)
+    router.message_handler(commands='GO')(noop)
+    router.message_handler(text="Начать", state='*')(noop)
+    dp.register_message_handler(noop, content_types=types.ContentTypes.CONTACT, state=Form.waiting_for_phone)
+    router.message_handler(text="Нет", state=Form.waiting_for_phone)(noop)
+    router.message_handler(text="Продолжить", state='*')(noop)
+    router.callback_query_handler(prefix="brakepoint")(noop)
+    dp.register_message_handler(noop, state=Questionnaire.custom_answer)
+    router.callback_query_handler(data="custom_answer", state=Questionnaire.asking)(noop)
+    router.callback_query_handler(data='nav:interrupt', state=Questionnaire.asking)(noop)
+    dp.register_message_handler(noop, state=Questionnaire.asking, content_types=types.ContentTypes.TEXT)
+    router.callback_query_handler(prefix=["a", "answer", "nav", "brakepoint"], state=Questionnaire.asking)(noop)
+    router.message_handler(commands='check_sub_debug')(noop)
+    router.message_handler(commands='manual')(noop)
+    dp.register_message_handler(noop, state=Manual.waiting_for_user_id, content_types=types.ContentTypes.TEXT)
+
+
+def make_updates():
+    user = {'id': 1, 'is_bot': False, 'first_name': 'bench'}
+    chat = {'id': 1, 'type': 'private'}
+    message = lambda i, text: {'update_id': i, 'message': {'message_id': i, 'date': 0, 'chat': chat, 'from': user, 'text': text}}  # noqa: E731
+    callback = lambda i, data: {'update_id': i, 'callback_query': {  # noqa: E731
+        'id': str(i), 'from': user, 'chat_instance': '1', 'data': data,
+        'message': {'message_id': 1, 'date': 0, 'chat': chat, 'text': 'q'},
+    }}
+    # Типичная сессия в состоянии Questionnaire.asking: в основном нажатия вариантов
+    mix = [
+        callback(0, 'a:12:3'), callback(0, 'a:12:1'), callback(0, 'nav:next'), callback(0, 'a:13:0'),
+        callback(0, 'nav:back'), callback(0, 'custom_answer'), message(0, 'свой ответ'),
+        message(0, 'Продолжить'), message(0, '/manual'), callback(0, 'nav:interrupt'),
+    ]
+    return [types.Update(**mix[i % len(mix)]) for i in range(UPDATES)]
+
+
+async def measure(label, build):
+    bot = Bot('123456:bench')
+    dp = Dispatcher(bot, storage=MemoryStorage())
+    build(dp)
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    await dp.storage.set_state(chat=1, user=1, state=Questionnaire.asking.state)
+    updates = make_updates()
+    loop = asyncio.get_running_loop()
+
+    async def process(update):
+        # Как при polling: каждое обновление — отдельная задача со своим контекстом
+        # (aiogram кэширует прочитанное состояние в contextvar на время обновления)
+        await loop.create_task(dp.process_update(update), context=contextvars.copy_context())
+
+    for update in updates[:500]:
+        await process(update)
+    started = time.perf_counter()
+    for update in updates:
+        await process(update)
+    elapsed = time.perf_counter() - started
+    await (await bot.get_session()).close()
+    print(f"{label:<6} {elapsed / len(updates) * 1e6:7.1f} мкс/обновление")
+    return elapsed
+
+
+async def main():
+    print(f"Обновлений {UPDATES}")
+    chain = await measure('chain', build_chain)
+    table = await measure('table', build_table)
+    print(f"ускорение x{chain / table:.2f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
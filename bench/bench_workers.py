@@ -0,0 +1,122 @@
+"""Нагрузочный тест супервизора: пропускная способность от числа воркеров.
+
+Без Telegram и без БД. Супервизор (supervisor.Supervisor) запускает N копий
+этого же скрипта в режиме воркера; воркер принимает обновления через
+webhook.run_worker_server-совместимый WebhookServer и на каждое нажатие
+строит клавиатуру вопроса и сериализует её в JSON (как перед отправкой в
+Bot API) — это CPU-работа, которая в одном процессе упирается в одно ядро.
+
+    python bench/bench_workers.py                  # 1, 2 и 4 воркера
+    BENCH_WORKERS=1,2,4,8 BENCH_UPDATES=20000 python bench/bench_workers.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp  # noqa: E402
+from aiogram import Bot, Dispatcher, types  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+from questionnaire import get_questionnaire  # noqa: E402
+from supervisor import WORKER_PATH, Supervisor  # noqa: E402
+from webhook import WebhookServer, serve_forever  # noqa: E402
+
+WORKER_COUNTS = [int(x) for x in os.getenv('BENCH_WORKERS', '1,2,4').split(',')]
+UPDATES = int(os.getenv('BENCH_UPDATES', '6000'))
+USERS = int(os.getenv('BENCH_USERS', '500'))
+# Сколько раз на обновление строить клавиатуру (подбирает «вес» обработчика)
+WORK = int(os.getenv('BENCH_WORK', '20'))
+BASE_PORT = int(os.getenv('BENCH_BASE_PORT', '8790'))
+
+
+def build_keyboard(questions, step, selected):
+    keyboard = types.InlineKeyboardMarkup(row_width=1)
+    for option_index, text in enumerate(questions.option_texts[step]):
+        mark = '✅ ' if text in selected else ''
+        keyboard.add(types.InlineKeyboardButton(mark + text, callback_data=questions.answer_callback(step, option_index)))
+    return json.dumps(keyboard.to_python(), ensure_ascii=False)
+
+
+async def worker():
+    questions = get_questionnaire()
+    steps = [i for i in range(len(questions)) if questions.option_texts[i]]
+    bot = Bot('123456:bench')
+    dp = Dispatcher(bot)
+
+    @dp.callback_query_handler()
+    async def on_click(callback_query: types.CallbackQuery):
+        step = steps[int(callback_query.data) % len(steps)]
+        selected = set(questions.option_texts[step][:2])
+        for _ in range(WORK):
+            build_keyboard(questions, step, selected)
+
+    server = WebhookServer(dp, WORKER_PATH, os.environ['BOT_WORKER_SECRET'])
+
+    async def processed(request):
+        return web.json_response(server.processed)
+
+    server.app.router.add_get('/processed', processed)
+    await serve_forever(server.app, '127.0.0.1', int(os.environ['BOT_WORKER_PORT']), on_stopping=server.drain)
+
+
+def make_update(update_id, user_id):
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'bench'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id), 'from': user, 'chat_instance': '1', 'data': str(update_id),
+            'message': {'message_id': 1, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}, 'text': 'q'},
+        },
+    }
+
+
+async def processed_total(session, supervisor):
+    total = 0
+    for index in range(supervisor.workers):
+        try:
+            async with session.get(f'http://127.0.0.1:{supervisor.base_port + index}/processed') as response:
+                total += await response.json()
+        except aiohttp.ClientError:
+            return None
+    return total
+
+
+async def run(workers):
+    supervisor = Supervisor(workers, BASE_PORT, command=[sys.executable, os.path.abspath(__file__), '--worker'])
+    await supervisor.start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            while await processed_total(session, supervisor) is None:
+                await asyncio.sleep(0.2)
+            started = time.perf_counter()
+            for update_id in range(UPDATES):
+                supervisor.dispatch(make_update(update_id, 1000 + update_id % USERS))
+            while (await processed_total(session, supervisor) or 0) < UPDATES:
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - started
+    finally:
+        await supervisor.stop()
+    return UPDATES / elapsed
+
+
+async def main():
+    print(f"Обновлений {UPDATES}, пользователей {USERS}, ядер {os.cpu_count()}")
+    base = None
+    for workers in WORKER_COUNTS:
+        rate = await run(workers)
+        base = base or rate
+        print(f"воркеров {workers}: {rate:8.0f} обновлений/с   x{rate / base:.2f}")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--worker']:
+        try:
+            asyncio.run(worker())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+    else:
+        asyncio.run(main())
@@ -0,0 +1,234 @@
+"""Фейковый сервер Bot API для нагрузочного теста (bench/bench_e2e.py).
+
+Отвечает на методы, которые вызывает бот, по адресу /bot<token>/<метод>
+(бот подключается через TELEGRAM_API_URL). Сообщения бота хранятся по
+чатам вместе с inline-клавиатурой, так что имитатор пользователя видит
+«экран» и нажимает кнопки из него. Обновления для бота ставятся в очередь
+push_* и отдаются через getUpdates (long polling). Каждый вызов метода
+записывается событием с временем — по ним считаются задержки.
+"""
+import asyncio
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+BOT_USER = {'id': 100000001, 'is_bot': True, 'first_name': 'Bench bot', 'username': 'bench_bot'}
+FILE_ID_PREFIX = 'fake-'
+
+
+class Event:
+    __slots__ = ('seq', 'time', 'method', 'params', 'result')
+
+    def __init__(self, seq, method, params, result):
+        self.seq = seq
+        self.time = time.perf_counter()
+        self.method = method
+        self.params = params
+        self.result = result
+
+
+class FakeBotAPI:
+    def __init__(self, host='127.0.0.1', port=8081):
+        self.host = host
+        self.port = port
+        self.url = f'http://{host}:{port}'
+        self.updates = []
+        self.calls = {}
+        # chat_id -> {message_id: message}
+        self.messages = {}
+        self.events = {}
+        self.documents = []
+        self.polling = asyncio.Event()
+        self._new_update = asyncio.Event()
+        self._changed = asyncio.Condition()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._seq = itertools.count(1)
+        self._callbacks = {}
+        self._runner = None
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    # --- обновления от «пользователей» ---
+
+    def _push(self, kind, payload):
+        update_id = next(self._update_ids)
+        self.updates.append({'update_id': update_id, kind: payload})
+        self._new_update.set()
+        return update_id
+
+    def _message(self, user, **fields):
+        return {
+            'message_id': next(self._message_ids), 'date': int(time.time()),
+            'chat': {'id': user['id'], 'type': 'private', 'first_name': user['first_name']},
+            'from': user, **fields,
+        }
+
+    def push_message(self, user, text):
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}] if text.startswith('/') else []
+        fields = {'text': text, 'entities': entities} if entities else {'text': text}
+        return self._push('message', self._message(user, **fields))
+
+    def push_contact(self, user, phone):
+        contact = {'phone_number': phone, 'first_name': user['first_name'], 'user_id': user['id']}
+        return self._push('message', self._message(user, contact=contact))
+
+    def push_callback(self, user, message, data):
+        callback_id = str(next(self._seq))
+        self._callbacks[callback_id] = user['id']
+        return self._push('callback_query', {
+            'id': callback_id, 'from': user, 'chat_instance': str(user['id']),
+            'message': dict(message), 'data': data,
+        })
+
+    # --- что видит пользователь ---
+
+    def screen(self, chat_id):
+        """Последнее не удалённое сообщение бота в чате (кроме фото галереи)."""
+        messages = self.messages.get(chat_id, {})
+        for message_id in sorted(messages, reverse=True):
+            if 'photo' not in messages[message_id]:
+                return messages[message_id]
+        return None
+
+    def last_seq(self, chat_id):
+        events = self.events.get(chat_id)
+        return events[-1].seq if events else 0
+
+    async def wait_for(self, chat_id, after, predicate, timeout=30):
+        """Первое событие в чате новее after, для которого predicate(event) истинно."""
+        def find():
+            for candidate in self.events.get(chat_id, ()):
+                if candidate.seq > after and predicate(candidate):
+                    return candidate
+            return None
+
+        async with self._changed:
+            await asyncio.wait_for(self._changed.wait_for(find), timeout)
+            return find()
+
+    # --- Bot API ---
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getUpdates':
+            return self._ok(await self.get_updates(params))
+        handler = getattr(self, 'm_' + method, None)
+        result = handler(params) if handler else True
+        return self._ok(result)
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({'ok': True, 'result': result})
+
+    async def get_updates(self, params):
+        self.polling.set()
+        offset = int(params.get('offset') or 0)
+        if offset:
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), min(float(params.get('timeout') or 0), 5))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit') or 100)
+        return self.updates[:limit]
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _event(self, chat_id, method, params, result=None):
+        self.events.setdefault(chat_id, []).append(Event(next(self._seq), method, params, result))
+        asyncio.get_running_loop().create_task(self._notify())
+        return result
+
+    def _store(self, chat_id, **fields):
+        message = {
+            'message_id': next(self._message_ids), 'date': int(time.time()), 'from': BOT_USER,
+            'chat': {'id': chat_id, 'type': 'private'}, **fields,
+        }
+        self.messages.setdefault(chat_id, {})[message['message_id']] = message
+        return message
+
+    @staticmethod
+    def _markup(params):
+        markup = params.get('reply_markup')
+        markup = json.loads(markup) if markup else None
+        return {'reply_markup': markup} if markup and 'inline_keyboard' in markup else {}
+
+    def _file_id(self):
+        return f'{FILE_ID_PREFIX}{next(self._file_ids)}'
+
+    def m_getMe(self, params):
+        return BOT_USER
+
+    def m_getWebhookInfo(self, params):
+        return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+
+    def m_sendMessage(self, params):
+        chat_id = int(params['chat_id'])
+        message = self._store(chat_id, text=params.get('text', ''), **self._markup(params))
+        return self._event(chat_id, 'sendMessage', params, message)
+
+    def _edit(self, params, **fields):
+        chat_id = int(params['chat_id'])
+        message = self.messages.get(chat_id, {}).get(int(params['message_id']))
+        if message is None:
+            return True
+        message.pop('reply_markup', None)
+        message.update(fields, **self._markup(params))
+        return message
+
+    def m_editMessageText(self, params):
+        message = self._edit(params, text=params.get('text', ''))
+        return self._event(int(params['chat_id']), 'editMessageText', params, message)
+
+    def m_editMessageReplyMarkup(self, params):
+        message = self._edit(params)
+        return self._event(int(params['chat_id']), 'editMessageReplyMarkup', params, message)
+
+    def m_deleteMessage(self, params):
+        chat_id = int(params['chat_id'])
+        self.messages.get(chat_id, {}).pop(int(params['message_id']), None)
+        return self._event(chat_id, 'deleteMessage', params, True)
+
+    def m_answerCallbackQuery(self, params):
+        chat_id = self._callbacks.pop(params['callback_query_id'], None)
+        return self._event(chat_id, 'answerCallbackQuery', params, True)
+
+    def m_sendMediaGroup(self, params):
+        chat_id = int(params['chat_id'])
+        media = json.loads(params['media'])
+        result = []
+        for item in media:
+            file_id = self._file_id()
+            photo = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 320, 'height': 320}]
+            result.append(self._store(chat_id, photo=photo, caption=item.get('caption')))
+        return self._event(chat_id, 'sendMediaGroup', {}, result)
+
+    def m_sendDocument(self, params):
+        chat_id = int(params['chat_id'])
+        document = params['document']
+        filename = getattr(document, 'filename', None)
+        file_id = document if isinstance(document, str) else self._file_id()
+        self.documents.append((time.perf_counter(), chat_id, filename, file_id))
+        message = self._store(chat_id, document={
+            'file_id': file_id, 'file_unique_id': file_id, 'file_name': filename or 'report.docx',
+        })
+        return self._event(chat_id, 'sendDocument', {'filename': filename}, message)
@@ -0,0 +1,229 @@
+"""Выгрузка заявок за период в CSV или XLSX: строка на заявку, колонка на вопрос.
+
+Колонки — данные заявки и вопросы отчёта из questions.json (без brakepoint и
+skip), в ячейке — выбранные варианты и свои ответы через «; » (как в отчёте,
+reports.build_report). Заявки с ответами читаются одним запросом через
+серверный курсор пачками по EXPORT_PREFETCH строк и сразу пишутся в файл
+(XLSX — openpyxl в режиме write_only), поэтому память не растёт с числом
+заявок. Сборка строк и запись файла идут в отдельном потоке, соединение с БД
+занято только на время чтения курсора. Текст ответов не становится формулой:
+в CSV перед «=», «+», «-», «@» ставится «'» (csv_cell), в XLSX ячейки пишутся
+с явным строковым типом; управляющие символы, недопустимые в XLSX, вырезаются.
+XLSX требует пакет openpyxl.
+
+    python export.py --from 2025-01-01 --to 2025-01-31 --format xlsx -o leads.xlsx
+    python export.py --from 2025-01-01 --all    # вместе с незавершёнными, по сегодня
+
+Из бота — команда администратора /export (main.py).
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import asyncpg
+from dotenv import load_dotenv
+
+from questionnaire import get_questionnaire
+from reports import build_report, fmt_dt
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+EXPORT_PREFETCH = 500
+ANSWER_SEPARATOR = '; '
+
+# Заявки, начатые в [$1, $2), с ответами, собранными в массивы (индекс user_answers_request_step_idx).
+# $3 — только завершённые (step_number = -1)
+EXPORT_SQL = """
+    SELECT d.id, d.id_telegram, d.tg_login, d.tg_firstname, d.tg_lastname, d.phone,
+           d.step_start, d.step_time, d.step_number,
+           a.steps, a.texts, a.types
+    FROM data_questions d
+    LEFT JOIN LATERAL (
+        SELECT array_agg(question_step ORDER BY question_step, id) AS steps,
+               array_agg(answer_text ORDER BY question_step, id) AS texts,
+               array_agg(answer_type ORDER BY question_step, id) AS types
+        FROM user_answers
+        WHERE request_id = d.id
+    ) a ON TRUE
+    WHERE d.step_start >= $1::date AND d.step_start < $2::date
+      AND (NOT $3::bool OR d.step_number = -1)
+    ORDER BY d.step_start, d.id
+"""
+# Первые символы, с которых Excel/LibreOffice начинают формулу (CSV/formula injection)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Управляющие символы, недопустимые в XLSX (= openpyxl.cell.cell.ILLEGAL_CHARACTERS_RE)
+ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+REQUEST_COLUMNS = (
+    'ID заявки', 'Telegram ID', 'Логин', 'Имя', 'Фамилия', 'Телефон',
+    'Начало опроса', 'Последний ответ', 'Завершена',
+)
+
+
+def parse_date(value):
+    """Дата из 2025-01-31 или 31.01.2025."""
+    for pattern in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value.strip(), pattern).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Неверная дата: {value} (ожидается ГГГГ-ММ-ДД или ДД.ММ.ГГГГ)")
+
+
+def csv_cell(value):
+    """Текст для CSV с «'» перед формулой (Excel иначе выполнит её при открытии)."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def export_header(questions):
+    return list(REQUEST_COLUMNS) + [
+        f"{number}. {questions[step]['text']}" for number, step in enumerate(questions.report_steps, 1)
+    ]
+
+
+def export_row(row, questions):
+    user_answers = [
+        {'question_step': step, 'answer_text': text, 'answer_type': answer_type}
+        for step, text, answer_type in zip(row['steps'] or (), row['texts'] or (), row['types'] or ())
+    ]
+    report = build_report(row['id_telegram'], row['id'], row, user_answers, questions)
+    return [
+        row['id'], row['id_telegram'], row['tg_login'] or '', row['tg_firstname'] or '', row['tg_lastname'] or '',
+        row['phone'] or '', fmt_dt(row['step_start']), fmt_dt(row['step_time']),
+        'да' if row['step_number'] == -1 else 'нет',
+    ] + [
+        ANSWER_SEPARATOR.join([text for text, _ in question.selected] + list(question.custom))
+        for question in report.questions
+    ]
+
+
+class CsvWriter:
+    def __init__(self, path):
+        # utf-8-sig — чтобы Excel сам распознал кодировку
+        self.file = open(path, 'w', encoding='utf-8-sig', newline='')
+        self.writer = csv.writer(self.file)
+
+    def write(self, row):
+        self.writer.writerow([csv_cell(value) for value in row])
+
+    def close(self):
+        self.file.close()
+
+
+class XlsxWriter:
+    def __init__(self, path):
+        try:
+            from openpyxl import Workbook
+            from openpyxl.cell import WriteOnlyCell
+        except ImportError as e:
+            raise RuntimeError('Для выгрузки в XLSX нужен пакет: ./venv/bin/pip install openpyxl') from e
+        self.cell = WriteOnlyCell
+        self.path = path
+        # write_only: строки сразу уходят во временный файл, а не держатся в памяти
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet('Заявки')
+
+    def _cell(self, value):
+        if not isinstance(value, str):
+            return value
+        cell = self.cell(self.sheet, ILLEGAL_CHARACTERS_RE.sub('', value))
+        # Явно строка: текст с «=» в начале не станет формулой, «+7…» и «-…» остаются как есть
+        cell.data_type = 's'
+        return cell
+
+    def write(self, row):
+        self.sheet.append([self._cell(value) for value in row])
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+WRITERS = {'csv': CsvWriter, 'xlsx': XlsxWriter}
+
+
+def _write_rows(writer, rows, questions):
+    for row in rows:
+        writer.write(export_row(row, questions))
+
+
+async def export_requests(pool, path, date_from, date_to, fmt='csv', completed_only=True):
+    """Записать заявки, начатые с date_from по date_to включительно, в path; вернуть их число."""
+    questions = get_questionnaire()
+    loop = asyncio.get_running_loop()
+    count = 0
+    # Один поток на выгрузку: writer пишет строки строго по порядку, а цикл событий
+    # бота не стоит, пока собираются строки и сохраняется файл
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='export') as executor:
+        writer = await loop.run_in_executor(executor, WRITERS[fmt], path)
+        try:
+            await loop.run_in_executor(executor, writer.write, export_header(questions))
+            async with pool.acquire() as connection:
+                # Серверный курсор живёт только внутри транзакции
+                async with connection.transaction():
+                    cursor = connection.cursor(
+                        EXPORT_SQL, date_from, date_to + timedelta(days=1), completed_only, prefetch=EXPORT_PREFETCH
+                    )
+                    batch = []
+                    async for row in cursor:
+                        batch.append(row)
+                        if len(batch) >= EXPORT_PREFETCH:
+                            await loop.run_in_executor(executor, _write_rows, writer, batch, questions)
+                            count += len(batch)
+                            batch = []
+                    if batch:
+                        await loop.run_in_executor(executor, _write_rows, writer, batch, questions)
+                        count += len(batch)
+        finally:
+            # Сохранение XLSX — уже без соединения с БД
+            await loop.run_in_executor(executor, writer.close)
+    return count
+
+
+def export_file_name(date_from, date_to, fmt):
+    return f"requests_{date_from.isoformat()}_{date_to.isoformat()}.{fmt}"
+
+
+async def _connect():
+    load_dotenv()
+    return await asyncpg.create_pool(
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=os.getenv('DB_NAME'),
+        host=os.getenv('DB_HOST'),
+        port=os.getenv('DB_PORT', '5432'),
+        min_size=1,
+        max_size=1
+    )
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description='Выгрузка заявок за период в CSV/XLSX')
+    parser.add_argument('--from', dest='date_from', required=True, type=parse_date, help='первый день периода')
+    parser.add_argument('--to', dest='date_to', type=parse_date, default=date.today(),
+                        help='последний день периода (по умолчанию сегодня)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--all', action='store_true', help='вместе с незавершёнными заявками')
+    parser.add_argument('-o', '--output', help='файл (по умолчанию requests_<с>_<по>.<формат>)')
+    args = parser.parse_args(argv)
+
+    path = args.output or export_file_name(args.date_from, args.date_to, args.format)
+    pool = await _connect()
+    try:
+        count = await export_requests(
+            pool, path, args.date_from, args.date_to, args.format, completed_only=not args.all
+        )
+    finally:
+        await pool.close()
+    print(f"Заявок выгружено: {count} → {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main()))
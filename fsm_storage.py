@@ -0,0 +1,331 @@
+"""Постоянное FSM-хранилище для aiogram вместо MemoryStorage.
+
+Состояние и данные пользователя хранятся одной компактной строкой на
+(chat, user) — в PostgreSQL (тот же пул asyncpg, что и у бота) или в Redis.
+Поверх бэкенда — кэш чтения (LRU + TTL) и отложенная запись: update_data и
+set_state только помечают запись «грязной», фоновая задача сбрасывает пачку
+изменений одним executemany/pipeline раз в flush_interval секунд.
+
+Кэш рассчитан на то, что апдейты одного пользователя обрабатывает один
+процесс (exclusive=True: воркер супервизора с шардированием по user id или
+единственный процесс бота); TTL ограничивает устаревание. Если процессов с
+общим бэкендом может быть несколько без шардирования (exclusive=False), кэш
+чтения выключен, а изменения записываются сразу, до возврата из set_state /
+update_data: иначе второй процесс читал бы устаревшее состояние и затирал
+более новое отложенной записью.
+
+Запись, которая сейчас сбрасывается, остаётся «закреплённой» (_flushing):
+кэш её не вытесняет, пока бэкенд не подтвердил сохранение. Удаляется из
+бэкенда только явно сброшенное состояние (reset_state, пустые state и data).
+"""
+import asyncio
+import copy
+import json
+import logging
+import time
+import typing
+from collections import OrderedDict
+from datetime import datetime
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from instrumented_pool import query_budget
+
+# Запросы PostgresStorage; тексты вынесены, чтобы пул мог заранее подготовить их
+# на каждом соединении (main.HOT_STATEMENTS)
+FSM_LOAD_SQL = """
+    SELECT chat_id, user_id, state, data FROM fsm_state
+    WHERE (chat_id, user_id) IN (SELECT * FROM unnest($1::bigint[], $2::bigint[]))
+"""
+FSM_SAVE_SQL = """
+    INSERT INTO fsm_state (chat_id, user_id, state, data, updated_at)
+    VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
+    ON CONFLICT (chat_id, user_id) DO UPDATE
+    SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+"""
+FSM_DELETE_SQL = """
+    DELETE FROM fsm_state
+    WHERE (chat_id, user_id) IN (SELECT * FROM unnest($1::bigint[], $2::bigint[]))
+"""
+
+# Сериализация: JSON с метками для типов, которые бот кладёт в state.
+# answers/custom_answers — dict с int-ключами (номер шага), last_interaction — datetime.
+
+def _encode(value):
+    if isinstance(value, dict):
+        if value and not all(isinstance(k, str) for k in value):
+            return {'$ik': [[k, _encode(v)] for k, v in value.items()]}
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if '$ik' in value:
+                return {k: _decode(v) for k, v in value['$ik']}
+            if '$dt' in value:
+                return datetime.fromisoformat(value['$dt'])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def dumps_data(data):
+    return json.dumps(_encode(data), ensure_ascii=False, separators=(',', ':'))
+
+
+def loads_data(raw):
+    return _decode(json.loads(raw)) if raw else {}
+
+
+class CachedStorage(BaseStorage):
+    """Общая часть: кэш чтения и пакетная отложенная запись.
+
+    Наследники реализуют _load(keys), _save(records) и _delete(keys),
+    где key = (chat_id, user_id), record = (key, state, data_raw).
+    """
+
+    def __init__(self, *, flush_interval=0.5, max_batch=500, cache_size=10000, cache_ttl=600, exclusive=True):
+        self.exclusive = exclusive
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()  # key -> [state, data, loaded_at]
+        self._dirty = set()
+        # Ключи, которые сейчас пишутся в бэкенд: их не вытесняем и не перечитываем
+        self._flushing = set()
+        self._flush_task = None
+        self._flush_wakeup = None
+        self._flush_lock = asyncio.Lock()
+        self._closed = False
+
+    # --- бэкенд ---
+
+    async def _load(self, keys) -> typing.Dict:
+        raise NotImplementedError
+
+    async def _save(self, records):
+        raise NotImplementedError
+
+    async def _delete(self, keys):
+        raise NotImplementedError
+
+    # --- кэш ---
+
+    def _key(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    def _pinned(self, key):
+        return key in self._dirty or key in self._flushing
+
+    async def _entry(self, key):
+        entry = self._cache.get(key)
+        fresh = self.exclusive and entry is not None and time.monotonic() - entry[2] < self.cache_ttl
+        if entry is not None and (self._pinned(key) or fresh):
+            self._cache.move_to_end(key)
+            return entry
+        loaded = (await self._load([key])).get(key)
+        state, raw = loaded if loaded else (None, None)
+        entry = [state, loads_data(raw), time.monotonic()]
+        # Пока ждали бэкенд, запись могли изменить — локальная версия новее
+        current = self._cache.get(key)
+        if current is not None and self._pinned(key):
+            return current
+        self._cache[key] = entry
+        self._evict()
+        return entry
+
+    def _evict(self):
+        while len(self._cache) > self.cache_size:
+            for key in self._cache:
+                if not self._pinned(key):
+                    del self._cache[key]
+                    break
+            else:
+                break
+
+    async def _mark_dirty(self, key):
+        self._dirty.add(key)
+        if not self.exclusive:
+            # Бэкенд общий с другими процессами — пишем сразу
+            await self.flush()
+            return
+        self._ensure_flusher()
+        if len(self._dirty) >= self.max_batch:
+            self._flush_wakeup.set()
+
+    def _ensure_flusher(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_wakeup = asyncio.Event()
+            self._flush_task = asyncio.get_running_loop().create_task(self._flusher())
+
+    async def _flusher(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка записи FSM-состояний: {e}")
+
+    async def flush(self):
+        """Записать все изменённые состояния в бэкенд."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            keys, self._dirty = self._dirty, set()
+            self._flushing |= keys
+            to_save, to_delete = [], []
+            for key in keys:
+                entry = self._cache.get(key)
+                if entry is None:
+                    # Закреплённые записи не вытесняются; отсутствие записи — не сброс
+                    logging.error(f"FSM-состояние {key} пропало из кэша до записи, пропускаем")
+                elif entry[0] is None and not entry[1]:
+                    to_delete.append(key)
+                else:
+                    to_save.append((key, entry[0], dumps_data(entry[1])))
+            try:
+                if to_save:
+                    await self._save(to_save)
+                if to_delete:
+                    await self._delete(to_delete)
+            except Exception:
+                # Не теряем изменения — повторим при следующем сбросе
+                self._dirty |= keys
+                raise
+            finally:
+                self._flushing -= keys
+                self._evict()
+
+    @property
+    def active_sessions(self):
+        """Сколько пользователей сейчас находится в каком-либо состоянии (по кэшу)."""
+        return sum(1 for entry in self._cache.values() if entry[0] is not None)
+
+    async def close(self):
+        self._closed = True
+        if self._flush_task is not None:
+            self._flush_wakeup.set()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    # --- интерфейс BaseStorage ---
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        entry = await self._entry(self._key(chat, user))
+        return entry[0] if entry[0] is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        entry = await self._entry(self._key(chat, user))
+        if not entry[1] and default:
+            return copy.deepcopy(default)
+        return copy.deepcopy(entry[1])
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        key = self._key(chat, user)
+        entry = await self._entry(key)
+        entry[0] = self.resolve_state(state)
+        await self._mark_dirty(key)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        key = self._key(chat, user)
+        entry = await self._entry(key)
+        entry[1] = copy.deepcopy(data) if data else {}
+        await self._mark_dirty(key)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        key = self._key(chat, user)
+        entry = await self._entry(key)
+        if data:
+            entry[1].update(copy.deepcopy(data))
+        if kwargs:
+            entry[1].update(copy.deepcopy(kwargs))
+        await self._mark_dirty(key)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        key = self._key(chat, user)
+        entry = await self._entry(key)
+        entry[0] = None
+        if with_data:
+            entry[1] = {}
+        await self._mark_dirty(key)
+
+    def has_bucket(self):
+        return False
+
+
+class PostgresStorage(CachedStorage):
+    """FSM в таблице fsm_state через общий пул asyncpg."""
+
+    def __init__(self, pool, **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+
+    @query_budget(1, name='fsm_load', label=False)
+    async def _load(self, keys):
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch(FSM_LOAD_SQL, [k[0] for k in keys], [k[1] for k in keys])
+        return {(row['chat_id'], row['user_id']): (row['state'], row['data']) for row in rows}
+
+    async def _save(self, records):
+        async with self.pool.acquire() as connection:
+            await connection.executemany(
+                FSM_SAVE_SQL, [(key[0], key[1], state, raw) for key, state, raw in records]
+            )
+
+    async def _delete(self, keys):
+        async with self.pool.acquire() as connection:
+            await connection.execute(FSM_DELETE_SQL, [k[0] for k in keys], [k[1] for k in keys])
+
+
+class RedisStorage(CachedStorage):
+    """То же, но в Redis (удобно для локального стенда). Нужен пакет redis."""
+
+    def __init__(self, url, prefix='fsm', **kwargs):
+        super().__init__(**kwargs)
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise RuntimeError('Для FSM_STORAGE=redis нужен пакет: ./venv/bin/pip install redis') from e
+        self.redis = Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def _redis_key(self, key):
+        return f'{self.prefix}:{key[0]}:{key[1]}'
+
+    async def _load(self, keys):
+        values = await self.redis.mget([self._redis_key(k) for k in keys])
+        result = {}
+        for key, value in zip(keys, values):
+            if value:
+                state, _, raw = value.partition('\n')
+                result[key] = (state or None, raw)
+        return result
+
+    async def _save(self, records):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, state, raw in records:
+                pipe.set(self._redis_key(key), f'{state or ""}\n{raw}')
+            await pipe.execute()
+
+    async def _delete(self, keys):
+        await self.redis.delete(*[self._redis_key(k) for k in keys])
+
+    async def close(self):
+        await super().close()
+        await self.redis.close()
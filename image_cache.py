@@ -0,0 +1,223 @@
+"""Локальный кэш картинок вариантов для отчётов.
+
+Картинка скачивается один раз, уменьшается до миниатюры под размер в
+отчёте (1 дюйм) и кладётся на диск по хэшу содержимого
+(blobs/ab/abcdef….img). Соответствие URL → файл, ETag/Last-Modified и время
+последнего использования хранятся в SQLite (index.sqlite), поэтому кэшем
+одновременно пользуются потоки и процессы сборки отчётов.
+
+Устаревшие записи перепроверяются условным запросом (If-None-Match /
+If-Modified-Since); если хост недоступен, отдаётся сохранённая копия.
+Суммарный размер ограничен: при превышении удаляются давно не
+использованные картинки (LRU).
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import requests
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не обязателен: без него храним оригинал
+    Image = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(BASE_DIR, 'image_cache')
+
+# 1 дюйм в отчёте; с запасом под печать 192 dpi
+THUMBNAIL_PX = 192
+
+
+def make_thumbnail(content, size=THUMBNAIL_PX):
+    """Уменьшить картинку до size×size (с сохранением пропорций)."""
+    if Image is None:
+        return content
+    try:
+        with Image.open(BytesIO(content)) as image:
+            image.thumbnail((size, size))
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            out = BytesIO()
+            image.save(out, format='JPEG', quality=85, optimize=True)
+            return out.getvalue()
+    except Exception as e:
+        logging.warning(f"Не удалось уменьшить картинку, храним как есть: {e}")
+        return content
+
+
+class ImageCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=200 * 1024 * 1024,
+                 revalidate_after=7 * 24 * 3600, timeout=10):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.timeout = timeout
+        if Image is None:
+            logging.warning("Pillow не установлен: картинки в отчётах не уменьшаются (pip install Pillow)")
+        os.makedirs(os.path.join(cache_dir, 'blobs'), exist_ok=True)
+        with self._db() as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS images (
+                    url TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    checked_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _db(self):
+        # Соединение на каждую операцию: объект кэша передаётся в потоки и процессы сборки отчётов
+        db = sqlite3.connect(os.path.join(self.cache_dir, 'index.sqlite'), timeout=30)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, 'blobs', digest[:2], digest + '.img')
+
+    def _read_blob(self, digest):
+        try:
+            with open(self._blob_path(digest), 'rb') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def _write_blob(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as file:
+                file.write(content)
+            os.replace(tmp_path, path)
+        return digest
+
+    def lookup(self, url):
+        """(байты или None, свежая ли копия, заголовки условного запроса)."""
+        now = time.time()
+        with self._db() as db:
+            row = db.execute(
+                "SELECT digest, etag, last_modified, checked_at FROM images WHERE url = ?", (url,)
+            ).fetchone()
+        cached = self._read_blob(row[0]) if row else None
+        if cached is None:
+            return None, False, {}
+        if now - row[3] < self.revalidate_after:
+            self._touch(url, now)
+            return cached, True, {}
+        headers = {}
+        if row[1]:
+            headers['If-None-Match'] = row[1]
+        if row[2]:
+            headers['If-Modified-Since'] = row[2]
+        return cached, False, headers
+
+    def digests(self, urls):
+        """{url: хэш содержимого} для картинок, которые уже есть в кэше."""
+        urls = list(urls)
+        result = {}
+        with self._db() as db:
+            for start in range(0, len(urls), 500):
+                chunk = urls[start:start + 500]
+                rows = db.execute(
+                    f"SELECT url, digest FROM images WHERE url IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                result.update(rows)
+        return result
+
+    def mark_checked(self, url):
+        """Сервер ответил 304: копия снова свежая."""
+        now = time.time()
+        with self._db() as db:
+            db.execute("UPDATE images SET checked_at = ?, used_at = ? WHERE url = ?", (now, now, url))
+
+    def mark_used(self, url):
+        self._touch(url, time.time())
+
+    def store(self, url, content, etag=None, last_modified=None):
+        """Сохранить скачанную картинку; возвращает байты миниатюры."""
+        now = time.time()
+        content = make_thumbnail(content)
+        digest = self._write_blob(content)
+        with self._db() as db:
+            db.execute(
+                """
+                INSERT INTO images (url, digest, size, etag, last_modified, checked_at, used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    digest = excluded.digest, size = excluded.size, etag = excluded.etag,
+                    last_modified = excluded.last_modified, checked_at = excluded.checked_at,
+                    used_at = excluded.used_at
+                """,
+                (url, digest, len(content), etag, last_modified, now, now)
+            )
+        self._enforce_limit()
+        return content
+
+    def get(self, url, proxies=None):
+        """Байты миниатюры по URL или None, если картинку получить не удалось."""
+        cached, fresh, headers = self.lookup(url)
+        if fresh:
+            return cached
+        try:
+            response = requests.get(url, headers=headers, timeout=self.timeout, proxies=proxies)
+            if response.status_code == 304 and cached is not None:
+                self.mark_checked(url)
+                return cached
+            response.raise_for_status()
+        except requests.RequestException as e:
+            if cached is not None:
+                logging.warning(f"Картинка недоступна, используется копия из кэша: {url} ({e})")
+                self.mark_used(url)
+                return cached
+            logging.warning(f"Не удалось загрузить изображение для отчёта: {url} ({e})")
+            return None
+        return self.store(url, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+    def _touch(self, url, now):
+        with self._db() as db:
+            db.execute("UPDATE images SET used_at = ? WHERE url = ?", (now, url))
+
+    def _enforce_limit(self):
+        with self._db() as db:
+            # Одинаковые картинки по разным URL лежат одним файлом — считаем по хэшу
+            total = db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM images GROUP BY digest)"
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for url, digest, size in db.execute(
+                "SELECT url, digest, size FROM images ORDER BY used_at"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM images WHERE url = ?", (url,))
+                still_used = db.execute("SELECT 1 FROM images WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+                if not still_used:
+                    total -= size
+                    try:
+                        os.remove(self._blob_path(digest))
+                    except OSError:
+                        pass
+
+    def warm(self, urls, proxies=None, concurrency=8):
+        """Заранее скачать картинки; возвращает (успешно, всего)."""
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda url: self.get(url, proxies) is not None, urls))
+        return sum(results), len(results)
@@ -0,0 +1,118 @@
+"""Параллельная загрузка картинок для отчёта.
+
+Перед сборкой DOCX собираются все URL картинок выбранных вариантов и
+скачиваются одновременно через общую aiohttp-сессию (keep-alive пул
+соединений). Число одновременных запросов к одному хосту ограничено
+(limit_per_host), прокси — тот же TELEGRAM_PROXY, что и для Bot API.
+На весь отчёт даётся общий срок (deadline): не успевшие картинки
+пропускаются, отчёт собирается без них.
+
+Если передан ImageCache, свежие копии берутся с диска без сети, устаревшие
+перепроверяются условным запросом, а при ошибке или нехватке времени
+используется сохранённая копия.
+"""
+import asyncio
+import logging
+
+import aiohttp
+
+
+class ImageFetcher:
+    def __init__(self, proxy=None, limit=32, limit_per_host=4, timeout=10, image_cache=None):
+        self.proxy = proxy
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.image_cache = image_cache
+        self._session = None
+
+    def _create_session(self):
+        connector_kwargs = {'limit': self.limit, 'limit_per_host': self.limit_per_host}
+        if self.proxy and self.proxy.startswith(('socks5://', 'socks4://')):
+            from aiohttp_socks import ProxyConnector
+            connector = ProxyConnector.from_url(self.proxy, **connector_kwargs)
+        else:
+            connector = aiohttp.TCPConnector(**connector_kwargs)
+        return aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    async def _cache_call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _download(self, url, headers):
+        # HTTP-прокси aiohttp принимает на запрос, SOCKS — через коннектор
+        proxy = self.proxy if self.proxy and self.proxy.startswith(('http://', 'https://')) else None
+        async with self.session.get(url, headers=headers, proxy=proxy) as response:
+            if response.status == 304:
+                return None, response.headers
+            response.raise_for_status()
+            return await response.read(), response.headers
+
+    async def _fetch(self, url, cached, headers):
+        content, response_headers = await self._download(url, headers)
+        if self.image_cache is None:
+            return content
+        if content is None:
+            await self._cache_call(self.image_cache.mark_checked, url)
+            return cached
+        return await self._cache_call(
+            self.image_cache.store, url, content,
+            response_headers.get('ETag'), response_headers.get('Last-Modified')
+        )
+
+    async def _lookup(self, urls):
+        if self.image_cache is None:
+            return {url: (None, False, {}) for url in urls}
+        return await self._cache_call(lambda: {url: self.image_cache.lookup(url) for url in urls})
+
+    async def fetch_all(self, urls, deadline=15.0):
+        """Скачать картинки параллельно; возвращает {url: байты} только для успешных."""
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        looked_up = await self._lookup(urls)
+        images = {url: cached for url, (cached, fresh, _) in looked_up.items() if fresh}
+        tasks = {
+            asyncio.ensure_future(self._fetch(url, cached, headers)): url
+            for url, (cached, fresh, headers) in looked_up.items() if not fresh
+        }
+        if not tasks:
+            return images
+
+        remaining = max(deadline - (loop.time() - started), 0)
+        done, pending = await asyncio.wait(tasks, timeout=remaining)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        for task, url in tasks.items():
+            stale = looked_up[url][0]
+            if task in pending:
+                error = f"не уложились в {deadline:g} с"
+            elif task.exception() is not None:
+                error = task.exception()
+            else:
+                if task.result() is not None:
+                    images[url] = task.result()
+                continue
+            if stale is not None:
+                logging.warning(f"Картинка недоступна, используется копия из кэша: {url} ({error})")
+                images[url] = stale
+            else:
+                logging.warning(f"Не удалось загрузить изображение для отчёта: {url} ({error})")
+        return images
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -1,4 +1,5 @@
 -- Таблицы для бота анкетирования Domastroi (standalone)
+-- Служебные таблицы и индексы создаёт python migrate.py (бот также применяет миграции при старте)
 
 CREATE TABLE IF NOT EXISTS users_designer (
     id SERIAL PRIMARY KEY,
@@ -0,0 +1,206 @@
+"""Обёртка пула asyncpg: метрики, журнал медленных запросов и бюджет запросов.
+
+Код бота берёт соединения как обычно (async with db_pool.acquire()), а
+обёртка:
+  * замеряет ожидание свободного соединения (metrics.DB_ACQUIRE_SECONDS);
+  * выдаёт соединение, которое замеряет каждый execute/executemany/fetch*
+    (metrics.DB_QUERY_SECONDS и счётчики по тексту запроса в statements);
+    запросы дольше slow_query_ms пишутся в лог и в slow_queries;
+  * считает запросы на одно входящее обновление (QueryCountMiddleware,
+    metrics.DB_QUERIES_PER_UPDATE).
+
+Бюджет запросов: функция с декоратором @query_budget(n) должна сама делать
+не больше n запросов; запросы вложенных функций со своим бюджетом
+считаются у них. При превышении — предупреждение в лог, а в строгом режиме
+(enforce_query_budgets(True), для нагрузочного теста) — QueryBudgetExceeded.
+Остальные атрибуты и методы пула и соединения пробрасываются как есть.
+"""
+import contextvars
+import functools
+import logging
+import re
+import time
+from collections import deque
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from metrics import DB_ACQUIRE_SECONDS, DB_QUERIES_PER_UPDATE, DB_QUERY_SECONDS
+
+BUDGET_MESSAGE = 'Превышен бюджет запросов к БД'
+STATEMENT_LABEL_LENGTH = 100
+
+# Текущий бюджет (функция с @query_budget) и счётчик текущего обновления
+_frame = contextvars.ContextVar('query_budget_frame', default=None)
+_update = contextvars.ContextVar('update_query_stats', default=None)
+_strict = False
+# имя функции -> сколько раз превышен бюджет
+budget_violations = {}
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class _Counter:
+    __slots__ = ('name', 'count', 'closed')
+
+    def __init__(self, name=None):
+        self.name = name
+        self.count = 0
+        self.closed = False
+
+
+def enforce_query_budgets(strict):
+    """True — превышение бюджета бросает QueryBudgetExceeded (иначе только лог)."""
+    global _strict
+    _strict = strict
+
+
+def _count_query():
+    # Закрытые счётчики не пополняются: фоновые задачи, созданные внутри
+    # обработчика, наследуют его контекст, но их запросы уже не его
+    for counter in (_frame.get(), _update.get()):
+        if counter is not None and not counter.closed:
+            counter.count += 1
+
+
+def query_budget(limit, *, name=None, label=True):
+    """Декоратор корутины: не больше limit собственных запросов к БД за вызов.
+
+    label=False — не подписывать этим именем обновление в bot_db_queries_per_update
+    (для загрузчиков кэшей, которые срабатывают до обработчика).
+    """
+    def decorator(func):
+        budget_name = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            frame = _Counter(budget_name)
+            stats = _update.get()
+            if label and stats is not None and stats.name is None:
+                stats.name = budget_name
+            token = _frame.set(frame)
+            try:
+                result = await func(*args, **kwargs)
+            finally:
+                frame.closed = True
+                _frame.reset(token)
+            if frame.count > limit:
+                budget_violations[budget_name] = budget_violations.get(budget_name, 0) + 1
+                message = f"{BUDGET_MESSAGE}: {budget_name} — {frame.count} при лимите {limit}"
+                if _strict:
+                    raise QueryBudgetExceeded(message)
+                logging.warning(message)
+            return result
+        return wrapper
+    return decorator
+
+
+class QueryCountMiddleware(BaseMiddleware):
+    """Число запросов к БД на обновление, с именем обработчика (первый @query_budget)."""
+
+    async def on_pre_process_update(self, update, data):
+        # Каждое обновление aiogram обрабатывает в своей задаче — значение не протекает
+        _update.set(_Counter())
+
+    async def on_post_process_update(self, update, result, data):
+        stats = _update.get()
+        if stats is None:
+            return
+        stats.closed = True
+        DB_QUERIES_PER_UPDATE.observe(stats.count, stats.name or 'other')
+
+
+def statement_label(query):
+    return re.sub(r'\s+', ' ', query).strip()[:STATEMENT_LABEL_LENGTH]
+
+
+class InstrumentedPool:
+    def __init__(self, pool, slow_query_ms=200, slow_log_size=100):
+        self.pool = pool
+        self.slow_query_seconds = slow_query_ms / 1000
+        # Последние медленные запросы: (время, секунды, запрос)
+        self.slow_queries = deque(maxlen=slow_log_size)
+        # подпись запроса -> [вызовов, секунд всего]
+        self.statements = {}
+        self._labels = {}
+
+    def acquire(self, *, timeout=None):
+        return _InstrumentedAcquire(self, timeout)
+
+    @property
+    def in_use(self):
+        """Сколько соединений сейчас выдано из пула."""
+        return self.pool.get_size() - self.pool.get_idle_size()
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    async def _run(self, method, query, args, kwargs):
+        _count_query()
+        started = time.perf_counter()
+        try:
+            return await method(query, *args, **kwargs)
+        finally:
+            self._record(query, time.perf_counter() - started)
+
+    def _record(self, query, elapsed):
+        label = self._labels.get(query)
+        if label is None:
+            label = self._labels[query] = statement_label(query)
+        entry = self.statements.get(label)
+        if entry is None:
+            entry = self.statements[label] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        DB_QUERY_SECONDS.observe(elapsed)
+        if elapsed >= self.slow_query_seconds:
+            self.slow_queries.append((time.time(), elapsed, label))
+            frame = _frame.get()
+            where = f" ({frame.name})" if frame is not None else ''
+            logging.warning(f"Медленный запрос {elapsed * 1000:.0f} мс{where}: {label}")
+
+
+class _InstrumentedAcquire:
+    def __init__(self, owner, timeout):
+        self.owner = owner
+        self.timeout = timeout
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        self.ctx = self.owner.pool.acquire(timeout=self.timeout)
+        connection = await self.ctx.__aenter__()
+        DB_ACQUIRE_SECONDS.observe(time.perf_counter() - started)
+        return _InstrumentedConnection(connection, self.owner)
+
+    async def __aexit__(self, *exc):
+        return await self.ctx.__aexit__(*exc)
+
+
+class _InstrumentedConnection:
+    def __init__(self, connection, owner):
+        self.connection = connection
+        self.owner = owner
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    async def execute(self, query, *args, **kwargs):
+        return await self.owner._run(self.connection.execute, query, args, kwargs)
+
+    async def executemany(self, query, args, **kwargs):
+        return await self.owner._run(self.connection.executemany, query, (args,), kwargs)
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self.owner._run(self.connection.fetch, query, args, kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self.owner._run(self.connection.fetchrow, query, args, kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self.owner._run(self.connection.fetchval, query, args, kwargs)
+
+    def cursor(self, query, *args, **kwargs):
+        # Курсор читается пачками по мере обхода — считается одним запросом, без замера времени
+        _count_query()
+        return self.connection.cursor(query, *args, **kwargs)
@@ -0,0 +1,162 @@
+"""Кэш file_id картинок вариантов, уже загруженных в Telegram.
+
+При первой отправке галереи вопроса картинки уходят по URL, и Telegram сам
+скачивает каждую. Из ответа запоминаем file_id самой крупной версии фото и
+дальше отправляем по нему — без повторного скачивания на стороне Telegram.
+Записи хранятся в таблице telegram_media (url, content_hash, file_id) и
+целиком читаются в память при старте. Если Telegram отверг file_id,
+записи галереи забываются и она переотправляется по URL.
+
+content_hash — хэш картинки в локальном кэше (image_cache). Сначала file_id
+ищется по хэшу, затем по URL: та же картинка под другим адресом уходит по уже
+известному file_id. Хэши картинок, которых не было в кэше при старте,
+берутся из кэша перед отправкой галереи, а не скачанные ещё картинки
+скачиваются в фоне — со следующей отправки они тоже сопоставляются по хэшу.
+"""
+import asyncio
+import logging
+
+from aiogram import types
+from aiogram.utils.exceptions import BadRequest
+
+
+class MediaCache:
+    def __init__(self, pool, image_cache=None, proxies=None):
+        self.pool = pool
+        # Если есть локальный кэш картинок, его хэши привязывают file_id к содержимому
+        self.image_cache = image_cache
+        self.proxies = proxies
+        self._file_ids = {}
+        self._hashes = {}
+        # content_hash -> file_id
+        self._by_hash = {}
+        # url -> фоновая задача, которая скачивает картинку ради хэша
+        self._hashing = {}
+
+    def __len__(self):
+        return len(self._file_ids)
+
+    async def load(self, urls=()):
+        """Прочитать сохранённые file_id; устаревшие по содержимому — не использовать."""
+        if self.image_cache is not None and urls:
+            self._hashes = await asyncio.get_running_loop().run_in_executor(
+                None, self.image_cache.digests, urls
+            )
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch("SELECT url, content_hash, file_id FROM telegram_media")
+        self._file_ids = {}
+        self._by_hash = {}
+        stale = []
+        for row in rows:
+            current = self._hashes.get(row['url'])
+            if current is not None and row['content_hash'] is not None and current != row['content_hash']:
+                stale.append(row['url'])
+                continue
+            self._file_ids[row['url']] = row['file_id']
+            if row['content_hash'] is not None:
+                self._by_hash.setdefault(row['content_hash'], row['file_id'])
+        if stale:
+            await self._delete(stale)
+        logging.info(f"file_id картинок в кэше: {len(self._file_ids)} (устарело {len(stale)})")
+
+    def file_id(self, url):
+        """Известный file_id картинки: по хэшу содержимого, затем по URL."""
+        digest = self._hashes.get(url)
+        if digest is not None and digest in self._by_hash:
+            return self._by_hash[digest]
+        return self._file_ids.get(url)
+
+    def build_media_group(self, images, caption):
+        """InputMediaPhoto для (индекс, url): по file_id, если он известен, иначе по URL."""
+        return [
+            types.InputMediaPhoto(self.file_id(url) or url, caption=caption if i == 0 else None)
+            for i, url in images
+        ]
+
+    async def _resolve_hashes(self, urls):
+        """Хэши картинок, появившихся в локальном кэше после старта; остальные — скачать в фоне."""
+        missing = [url for url in urls if url not in self._hashes]
+        if self.image_cache is None or not missing:
+            return
+        loop = asyncio.get_running_loop()
+        self._hashes.update(await loop.run_in_executor(None, self.image_cache.digests, missing))
+        for url in missing:
+            if url not in self._hashes and url not in self._hashing:
+                self._hashing[url] = loop.create_task(self._hash_in_background(url))
+
+    async def _hash_in_background(self, url):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.image_cache.get, url, self.proxies)
+            digest = (await loop.run_in_executor(None, self.image_cache.digests, [url])).get(url)
+            if digest is None:
+                return
+            self._hashes[url] = digest
+            file_id = self._file_ids.get(url)
+            if file_id is None:
+                return
+            self._by_hash.setdefault(digest, file_id)
+            async with self.pool.acquire() as connection:
+                await connection.execute(
+                    "UPDATE telegram_media SET content_hash = $2 WHERE url = $1", url, digest
+                )
+        except Exception as e:
+            logging.warning(f"Не удалось получить хэш картинки {url}: {e}")
+        finally:
+            self._hashing.pop(url, None)
+
+    async def answer_media_group(self, message, images, caption):
+        """Отправить галерею вопроса в чат message, запомнив новые file_id."""
+        await self._resolve_hashes([url for _, url in images])
+        uses_file_ids = any(self.file_id(url) is not None for _, url in images)
+        try:
+            sent = await message.answer_media_group(self.build_media_group(images, caption))
+        except BadRequest as e:
+            if not uses_file_ids:
+                raise
+            logging.warning(f"Telegram отклонил file_id картинок, отправляем по URL: {e}")
+            await self.forget([url for _, url in images])
+            sent = await message.answer_media_group(self.build_media_group(images, caption))
+        await self._remember(images, sent)
+        return sent
+
+    async def _remember(self, images, sent):
+        fresh = []
+        for (_, url), sent_message in zip(images, sent):
+            if url in self._file_ids or not sent_message.photo:
+                continue
+            # photo — размеры по возрастанию; крупнейший — оригинал
+            file_id = sent_message.photo[-1].file_id
+            self._file_ids[url] = file_id
+            digest = self._hashes.get(url)
+            if digest is not None:
+                self._by_hash.setdefault(digest, file_id)
+            fresh.append((url, digest, file_id))
+        if not fresh:
+            return
+        try:
+            async with self.pool.acquire() as connection:
+                await connection.executemany("""
+                    INSERT INTO telegram_media (url, content_hash, file_id)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (url) DO UPDATE SET
+                        content_hash = EXCLUDED.content_hash, file_id = EXCLUDED.file_id,
+                        updated_at = CURRENT_TIMESTAMP
+                """, fresh)
+        except Exception as e:
+            # file_id остаются в памяти; в БД запишутся при следующей отправке после рестарта
+            logging.error(f"Ошибка сохранения file_id картинок: {e}")
+
+    async def forget(self, urls):
+        for url in urls:
+            self._by_hash.pop(self._hashes.get(url), None)
+        urls = [url for url in urls if self._file_ids.pop(url, None) is not None]
+        if urls:
+            await self._delete(urls)
+
+    async def _delete(self, urls):
+        try:
+            async with self.pool.acquire() as connection:
+                await connection.execute("DELETE FROM telegram_media WHERE url = ANY($1::text[])", urls)
+        except Exception as e:
+            logging.error(f"Ошибка удаления file_id картинок: {e}")
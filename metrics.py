@@ -0,0 +1,199 @@
+"""Метрики в формате Prometheus (text exposition 0.0.4) без внешних зависимостей.
+
+Гистограммы — модульные объекты, их пополняют сами компоненты:
+HANDLER_SECONDS (обработчики и шаги анкеты, декоратор timed),
+TELEGRAM_REQUEST_SECONDS (запросы к Bot API по методам, outbound.OutboundBot)
+и DB_* (ожидание соединения, время запросов и запросов на обновление —
+instrumented_pool).
+Текущие значения (глубина очередей, число сессий и т.п.) снимаются в
+момент запроса /metrics функциями, зарегистрированными через gauge/counter.
+
+Наблюдения копятся всегда (это пара операций со списком); HTTP-сервер
+поднимается, только если задан METRICS_PORT (см. start_metrics_server).
+"""
+import functools
+import logging
+import math
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # значения меток -> [счётчики по корзинам (не накопительные) ..., +Inf, сумма]
+        self._series = {}
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, series in sorted(self._series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                total += count
+                le = f'le="{_number(bound)}"'
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {total}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {total}'
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class CallbackMetric:
+    """gauge или counter, значение которого читается функцией в момент запроса.
+
+    Функция возвращает число, None (метрика пропускается) или, если заданы
+    метки, словарь {значения меток (кортеж или строка): число}.
+    """
+
+    def __init__(self, name, documentation, kind, func, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception as e:
+            logging.warning(f"Метрика {self.name} недоступна: {e}")
+            return
+        if value is None:
+            return
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.kind}'
+        if not self.labelnames:
+            yield f'{self.name} {_number(value)}'
+            return
+        for labels, item in sorted(value.items()):
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(item)}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        # Повторная регистрация под тем же именем заменяет прежнюю (перезапуск main() в одном процессе)
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge(name, documentation, func, labelnames=()):
+    return REGISTRY.register(CallbackMetric(name, documentation, 'gauge', func, labelnames))
+
+
+def counter(name, documentation, func, labelnames=()):
+    return REGISTRY.register(CallbackMetric(name, documentation, 'counter', func, labelnames))
+
+
+HANDLER_SECONDS = histogram(
+    'bot_handler_seconds', 'Время обработчиков и шагов анкеты', ['handler']
+)
+TELEGRAM_REQUEST_SECONDS = histogram(
+    'bot_telegram_request_seconds', 'Время запроса к Bot API (без ожидания в очереди отправки)', ['method']
+)
+DB_ACQUIRE_SECONDS = histogram(
+    'bot_db_pool_acquire_seconds', 'Ожидание свободного соединения из пула asyncpg', buckets=FAST_BUCKETS
+)
+DB_QUERY_SECONDS = histogram(
+    'bot_db_query_seconds', 'Время одного запроса к БД', buckets=FAST_BUCKETS
+)
+DB_QUERIES_PER_UPDATE = histogram(
+    'bot_db_queries_per_update', 'Запросов к БД на одно обновление Telegram', ['handler'],
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+)
+
+
+def timed(func=None, *, name=None):
+    """Декоратор корутины: время выполнения в HANDLER_SECONDS{handler=имя функции}."""
+    if func is None:
+        return functools.partial(timed, name=name)
+    label = name or func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, label)
+    return wrapper
+
+
+async def start_metrics_server(host, port, registry=REGISTRY):
+    """Поднять GET /metrics; возвращает AppRunner (остановить — runner.cleanup())."""
+    async def handle(request):
+        return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Метрики: http://{host}:{port}/metrics")
+    return runner
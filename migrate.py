@@ -0,0 +1,213 @@
+"""Версионные миграции схемы БД.
+
+Миграции — файлы migrations/NNNN_описание.sql, применяются по порядку
+номеров, каждая в своей транзакции; применённые записываются в
+schema_migrations. Несколько процессов бота не применят миграцию дважды —
+прогон идёт под advisory lock.
+
+    python migrate.py                # применить новые миграции
+    python migrate.py --status       # показать, что применено
+    python migrate.py --check-plans  # проверить планы горячих запросов
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+
+import asyncpg
+from dotenv import load_dotenv
+
+from answer_journal import COMMIT_STEP_SQL
+from report_cache import REPORT_STATE_SQL
+from session_cache import SESSION_SQL
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(BASE_DIR, 'migrations')
+# Ключ advisory lock для прогона миграций (произвольная константа)
+MIGRATION_LOCK_KEY = 724100201
+
+_MIGRATION_RE = re.compile(r'^(\d+)_(.+)\.sql$')
+
+
+def list_migrations():
+    migrations = []
+    for file_name in os.listdir(MIGRATIONS_DIR):
+        match = _MIGRATION_RE.match(file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, file_name)))
+    migrations.sort()
+    return migrations
+
+
+async def _applied_versions(connection):
+    await connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    return {row['version'] for row in await connection.fetch("SELECT version FROM schema_migrations")}
+
+
+async def apply_migrations_on(connection):
+    """Применить новые миграции на данном соединении. Возвращает список применённых."""
+    await connection.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_KEY)
+    try:
+        applied = await _applied_versions(connection)
+        done = []
+        for version, name, path in list_migrations():
+            if version in applied:
+                continue
+            with open(path, 'r', encoding='utf-8') as file:
+                sql = file.read()
+            async with connection.transaction():
+                await connection.execute(sql)
+                await connection.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                    version, name
+                )
+            logging.info(f"Применена миграция {version:04d}_{name}")
+            done.append(version)
+        return done
+    finally:
+        await connection.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+
+
+async def apply_migrations(pool):
+    async with pool.acquire() as connection:
+        return await apply_migrations_on(connection)
+
+
+# --- Проверка планов горячих запросов ---
+
+# Таблицы, которые наполняются тестовыми данными; Seq Scan по ним — ошибка
+SEEDED_TABLES = ('users_designer', 'data_questions', 'user_answers')
+SEED_USERS = 20000
+SEED_REQUESTS_PER_USER = 2
+SEED_ANSWERS_PER_REQUEST = 10
+
+# (название, SQL, параметры) — запросы, выполняемые на каждое нажатие и при отчёте
+HOT_STATEMENTS = [
+    ("сессия: заявка, шаг, статус, root", SESSION_SQL, (1001,)),
+    ("load_user_answers / отчёт",
+     "SELECT question_step, answer_text, answer_type FROM user_answers WHERE id_telegram = $1 AND request_id = $2",
+     (1001, 1)),
+    ("удаление ответа",
+     "DELETE FROM user_answers WHERE id_telegram=$1 AND request_id=$2 AND question_step=$3 AND answer_text=$4",
+     (1001, 1, 5, 'option 1')),
+    ("заявка, версия и кэш отчёта", REPORT_STATE_SQL, (1001, 1)),
+    ("/manual: есть ли заявки",
+     "SELECT EXISTS(SELECT 1 FROM data_questions WHERE id_telegram = $1)", (1001,)),
+    ("commit step", COMMIT_STEP_SQL,
+     (1001, 1, [5], ['option 1'], ['login'], [6], ['option 2'], ['button'], 7)),
+    ("/reset: ответы пользователя",
+     "DELETE FROM user_answers WHERE id_telegram = $1", (1001,)),
+]
+
+
+def _seq_scans(plan, tables):
+    found = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in tables:
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found.extend(_seq_scans(child, tables))
+    return found
+
+
+async def _seed(connection):
+    await connection.execute(
+        """
+        INSERT INTO users_designer (id_telegram, tg_login, status, last_step, root)
+        SELECT 1000 + g, 'user' || g, 1, 1, 1 FROM generate_series(1, $1) AS g
+        """,
+        SEED_USERS
+    )
+    await connection.execute(
+        """
+        INSERT INTO data_questions (user_id, id_telegram, step_start, root)
+        SELECT 1000 + u, 1000 + u, now() - (r || ' days')::interval, 1
+        FROM generate_series(1, $1) AS u, generate_series(1, $2) AS r
+        """,
+        SEED_USERS, SEED_REQUESTS_PER_USER
+    )
+    await connection.execute(
+        """
+        INSERT INTO user_answers (id_telegram, request_id, question_step, answer_type, answer_text, root)
+        SELECT d.id_telegram, d.id, a, 'button', 'option ' || (a % 4), 1
+        FROM data_questions d, generate_series(1, $1) AS a
+        """,
+        SEED_ANSWERS_PER_REQUEST
+    )
+    for table in SEEDED_TABLES:
+        await connection.execute(f"ANALYZE {table}")
+
+
+async def check_plans(connection, schema='migrate_plan_check'):
+    """Применить миграции в отдельной схеме, наполнить её и проверить EXPLAIN.
+
+    Возвращает список нарушений [(название запроса, таблица)].
+    """
+    await connection.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    await connection.execute(f"CREATE SCHEMA {schema}")
+    try:
+        await connection.execute(f"SET search_path TO {schema}")
+        await apply_migrations_on(connection)
+        await _seed(connection)
+        violations = []
+        for name, sql, args in HOT_STATEMENTS:
+            raw = await connection.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args)
+            plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+            for table in _seq_scans(plan, SEEDED_TABLES):
+                violations.append((name, table))
+            logging.info(f"{name}: {plan['Node Type']} (cost {plan['Total Cost']})")
+        return violations
+    finally:
+        await connection.execute("RESET search_path")
+        await connection.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+
+
+async def _connect():
+    load_dotenv()
+    return await asyncpg.connect(
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=os.getenv('DB_NAME'),
+        host=os.getenv('DB_HOST'),
+        port=os.getenv('DB_PORT', '5432')
+    )
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description='Миграции схемы БД бота')
+    parser.add_argument('--status', action='store_true', help='показать применённые миграции')
+    parser.add_argument('--check-plans', action='store_true', help='EXPLAIN горячих запросов на наполненной схеме')
+    args = parser.parse_args(argv)
+
+    connection = await _connect()
+    try:
+        if args.status:
+            applied = await _applied_versions(connection)
+            for version, name, _ in list_migrations():
+                print(f"{'+' if version in applied else ' '} {version:04d}_{name}")
+            return 0
+        if args.check_plans:
+            violations = await check_plans(connection)
+            for name, table in violations:
+                print(f"Seq Scan по {table}: {name}")
+            return 1 if violations else 0
+        done = await apply_migrations_on(connection)
+        print(f"Применено миграций: {len(done)}")
+        return 0
+    finally:
+        await connection.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,58 @@
+-- Базовые таблицы бота (как в init_db.sql) и служебные таблицы FSM и таймеров
+
+CREATE TABLE IF NOT EXISTS users_designer (
+    id SERIAL PRIMARY KEY,
+    id_telegram BIGINT NOT NULL UNIQUE,
+    tg_login VARCHAR(255),
+    tg_firstname VARCHAR(255),
+    tg_lastname VARCHAR(255),
+    status INTEGER DEFAULT 0,
+    phone VARCHAR(20),
+    last_step INTEGER,
+    subscribe INTEGER DEFAULT 0,
+    root BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS data_questions (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    id_telegram BIGINT NOT NULL,
+    tg_login TEXT,
+    tg_firstname TEXT,
+    tg_lastname TEXT,
+    phone TEXT,
+    step_start TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    step_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    step_number INTEGER DEFAULT 0,
+    root BIGINT
+);
+
+CREATE TABLE IF NOT EXISTS user_answers (
+    id SERIAL PRIMARY KEY,
+    id_telegram BIGINT NOT NULL,
+    tg_login TEXT,
+    request_id INTEGER NOT NULL,
+    question_step INTEGER NOT NULL,
+    answer_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    answer_type TEXT,
+    answer_text TEXT,
+    root INTEGER
+);
+
+-- Состояния FSM бота (позиция в анкете, ответы), переживают перезапуск
+CREATE TABLE IF NOT EXISTS fsm_state (
+    chat_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    state TEXT,
+    data TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_id, user_id)
+);
+
+-- Сроки таймеров бездействия (срабатывают и после перезапуска бота)
+CREATE TABLE IF NOT EXISTS inactivity_timers (
+    id_telegram BIGINT PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    message_id BIGINT,
+    deadline TIMESTAMP WITH TIME ZONE NOT NULL
+);
@@ -0,0 +1,27 @@
+-- Индексы под запросы, которые выполняются на каждое нажатие и при сборке отчёта
+
+-- Ответы пользователя по заявке (продолжение анкеты, отчёт) и удаление конкретного ответа
+CREATE INDEX IF NOT EXISTS user_answers_user_request_step_text_idx
+    ON user_answers (id_telegram, request_id, question_step, answer_text);
+
+-- Последняя заявка пользователя (get_request_id: ORDER BY step_start DESC LIMIT 1)
+CREATE INDEX IF NOT EXISTS data_questions_user_step_start_idx
+    ON data_questions (id_telegram, step_start DESC);
+
+-- Ответы заявки без привязки к пользователю (выгрузка, каскадное удаление)
+CREATE INDEX IF NOT EXISTS user_answers_request_step_idx
+    ON user_answers (request_id, question_step);
+
+-- Ответ всегда относится к существующей заявке. NOT VALID: старые строки
+-- (в т.ч. из бэкапа) не проверяются, ограничение действует для новых.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'user_answers_request_id_fkey' AND conrelid = 'user_answers'::regclass
+    ) THEN
+        ALTER TABLE user_answers
+            ADD CONSTRAINT user_answers_request_id_fkey
+            FOREIGN KEY (request_id) REFERENCES data_questions (id) ON DELETE CASCADE NOT VALID;
+    END IF;
+END $$;
@@ -0,0 +1,9 @@
+-- file_id картинок вариантов, уже загруженных в Telegram: повторно шлём по file_id, а не по URL.
+-- content_hash — хэш содержимого из локального кэша картинок (если известен):
+-- сменилась картинка по тому же URL — запись устаревает и file_id получается заново.
+CREATE TABLE IF NOT EXISTS telegram_media (
+    url TEXT PRIMARY KEY,
+    content_hash TEXT,
+    file_id TEXT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
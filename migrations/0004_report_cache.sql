@@ -0,0 +1,9 @@
+-- Собранные DOCX-отчёты по заявкам: пока ответы, заголовок заявки и анкета не менялись
+-- (version), /manual и повторные отправки берут готовый файл и уже полученный file_id.
+CREATE TABLE IF NOT EXISTS report_cache (
+    request_id INTEGER PRIMARY KEY REFERENCES data_questions (id) ON DELETE CASCADE,
+    version TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    file_id TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,3 @@
+-- Выгрузка заявок за период (export.py): диапазон по дате начала опроса
+CREATE INDEX IF NOT EXISTS data_questions_step_start_idx
+    ON data_questions (step_start);
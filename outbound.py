@@ -0,0 +1,291 @@
+"""Очередь исходящих запросов к Bot API с ограничением скорости и приоритетами.
+
+Все отправки бота проходят через OutboundBot.request и ждут своей очереди в
+OutboundQueue. Скорость ограничивают корзины токенов: общая на бота
+(global_rate запросов в секунду) и отдельная на каждый чат (chat_rate в
+секунду с запасом chat_burst). Альбом (sendMediaGroup) расходует столько
+токенов, сколько в нём сообщений, — и в общей корзине, и в корзине чата. Правка и удаление сообщений и ответы на
+нажатия (INTERACTIVE_METHODS) не тратят токены корзины чата — иначе листание
+вопросов с картинками быстро выбирало бы её, — но ждут, если чат заблокирован
+по flood control. Из ожидающих первым уходит запрос с меньшим номером
+приоритета, которому позволяет корзина его чата:
+
+  INTERACTIVE — ответы на нажатия и правка клавиатуры;
+  NORMAL      — обычные сообщения пользователю;
+  BULK        — массовые отправки (рассылка отчёта администраторам),
+                включаются контекстом `with bulk_priority():`.
+
+На RetryAfter (flood control) чат блокируется на указанное Telegram время,
+и запрос повторяется, всего не больше max_retries раз. Служебные методы
+(getUpdates, getMe, setWebhook…) идут мимо очереди.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+from metrics import TELEGRAM_REQUEST_SECONDS
+
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+
+INTERACTIVE_METHODS = frozenset({
+    'answerCallbackQuery', 'editMessageText', 'editMessageReplyMarkup',
+    'editMessageCaption', 'editMessageMedia', 'deleteMessage',
+})
+SEND_METHODS = INTERACTIVE_METHODS | frozenset({
+    'sendMessage', 'sendPhoto', 'sendDocument', 'sendMediaGroup', 'sendVideo',
+    'sendAudio', 'sendVoice', 'sendAnimation', 'sendSticker', 'sendContact',
+    'sendLocation', 'forwardMessage', 'copyMessage',
+})
+
+_bulk = contextvars.ContextVar('outbound_bulk', default=False)
+
+
+@contextmanager
+def bulk_priority():
+    """Отправки внутри блока (и запущенных из него задач) идут с приоритетом BULK."""
+    token = _bulk.set(True)
+    try:
+        yield
+    finally:
+        _bulk.reset(token)
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now, cost=1):
+        """Через сколько секунд будет доступно cost токенов (0 — уже сейчас).
+
+        Запрос дороже запаса ждёт полной корзины и уводит её в минус:
+        следующие запросы чата подождут, пока долг не восстановится.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        need = min(cost, self.capacity)
+        if need == 0 or self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def take(self, cost=1):
+        self.tokens -= cost
+
+    def block(self, now, seconds):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+
+    def idle(self, now):
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class OutboundQueue:
+    def __init__(self, global_rate=25.0, chat_rate=1.0, chat_burst=4, max_retries=3, max_chats=10000):
+        self.global_bucket = TokenBucket(global_rate, max(global_rate, 1))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats = {}
+        # [priority, seq, chat_id, future, enqueued_at, chat_cost, cost]
+        self._waiting = []
+        self._seq = 0
+        self._task = None
+        self._wakeup = None
+        self.sent = 0
+        self.retries = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def depth(self):
+        return len(self._waiting)
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'sent': self.sent,
+            'retries': self.retries,
+            'wait_avg': self.wait_total / self.sent if self.sent else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                now = time.monotonic()
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def acquire(self, chat_id, priority, chat_cost=1, cost=1):
+        """Дождаться разрешения на отправку в chat_id (None — только общий лимит).
+
+        cost — сколько сообщений отправит запрос (токены общей корзины),
+        chat_cost — сколько токенов корзины чата он расходует (0 — не расходует).
+        """
+        self._ensure_running()
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        self._waiting.append([priority, self._seq, chat_id, future, time.monotonic(), chat_cost, cost])
+        self._wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            self._waiting = [entry for entry in self._waiting if entry[3] is not future]
+            raise
+
+    async def _run(self):
+        while True:
+            if not self._waiting:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            now = time.monotonic()
+            sleep_for = float('inf')
+            chosen = None
+            for entry in sorted(self._waiting):
+                chat_id = entry[2]
+                delay = 0.0 if chat_id is None else self._chat_bucket(chat_id).delay(now, entry[5])
+                if delay == 0:
+                    # Первый по приоритету запрос, которому позволяет чат, ждёт общую корзину
+                    # сам, не пропуская вперёд остальных: иначе альбомы ждали бы бесконечно
+                    delay = self.global_bucket.delay(now, entry[6])
+                    if delay == 0:
+                        chosen = entry
+                    else:
+                        sleep_for = min(sleep_for, delay)
+                    break
+                sleep_for = min(sleep_for, delay)
+            if chosen is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), sleep_for)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._waiting.remove(chosen)
+            self.global_bucket.take(chosen[6])
+            if chosen[2] is not None:
+                self._chat_bucket(chosen[2]).take(chosen[5])
+            waited = now - chosen[4]
+            self.sent += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            if waited > 5:
+                logging.warning(f"Исходящий запрос ждал очереди {waited:.1f} с (в очереди {self.depth})")
+            if not chosen[3].done():
+                chosen[3].set_result(None)
+
+    def flood_wait(self, chat_id, seconds):
+        """Telegram ответил RetryAfter: не слать в чат (или вообще) seconds секунд."""
+        now = time.monotonic()
+        bucket = self.global_bucket if chat_id is None else self._chat_bucket(chat_id)
+        bucket.block(now, seconds)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def call(self, chat_id, priority, func, chat_cost=1, cost=1):
+        """Выполнить func() в порядке очереди, повторяя при flood control."""
+        attempt = 0
+        while True:
+            await self.acquire(chat_id, priority, chat_cost, cost)
+            try:
+                return await func()
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.retries += 1
+                # Каждый повтор ждёт чуть дольше, чем просит Telegram
+                wait = e.timeout + attempt
+                logging.warning(f"Flood control для чата {chat_id}: повтор через {wait} с (попытка {attempt})")
+                self.flood_wait(chat_id, wait)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def _message_count(method, data):
+    """Сколько сообщений отправит запрос: альбом — по числу элементов, прочие — 1."""
+    if method == 'sendMediaGroup':
+        media = (data or {}).get('media')
+        if isinstance(media, str):
+            try:
+                media = json.loads(media)
+            except ValueError:
+                return 1
+        return max(len(media or ()), 1)
+    return 1
+
+
+def _rewind_files(files):
+    for value in (files or {}).values():
+        file = value[1] if isinstance(value, tuple) else getattr(value, 'file', value)
+        if hasattr(file, 'seek'):
+            file.seek(0)
+
+
+class OutboundBot(Bot):
+    """Bot, у которого все отправки проходят через OutboundQueue."""
+
+    def __init__(self, *args, outbound=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbound = outbound or OutboundQueue()
+
+    async def _timed_request(self, method, data, files, **kwargs):
+        # getUpdates — long polling, его время не показательно
+        if method == 'getUpdates':
+            return await super().request(method, data, files, **kwargs)
+        with TELEGRAM_REQUEST_SECONDS.time(method):
+            return await super().request(method, data, files, **kwargs)
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if method not in SEND_METHODS:
+            return await self._timed_request(method, data, files, **kwargs)
+        if method in INTERACTIVE_METHODS:
+            priority = INTERACTIVE
+        elif _bulk.get():
+            priority = BULK
+        else:
+            priority = NORMAL
+        chat_id = (data or {}).get('chat_id')
+        if chat_id is not None:
+            chat_id = str(chat_id)
+        first = True
+
+        async def send():
+            nonlocal first
+            if not first:
+                _rewind_files(files)
+            first = False
+            return await self._timed_request(method, data, files, **kwargs)
+
+        cost = _message_count(method, data)
+        # Правки и ответы на нажатия не тратят корзину чата, но учитываются в общем лимите
+        chat_cost = 0 if method in INTERACTIVE_METHODS else cost
+        return await self.outbound.call(chat_id, priority, send, chat_cost, cost)
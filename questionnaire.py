@@ -0,0 +1,259 @@
+"""Скомпилированная модель анкеты (questions.json).
+
+Файл разбирается один раз, все производные таблицы (переходы с пропуском
+skip-вопросов, позиции brakepoint, индексы вариантов, признаки картинок)
+считаются заранее. Модель неизменяема: при изменении файла (mtime) или по
+SIGHUP собирается новая и атомарно подменяет ссылку на текущую.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+QUESTIONS_PATH = os.path.join(BASE_DIR, 'questions.json')
+
+# Как часто (сек) сверять mtime файла при обращении к модели
+RELOAD_CHECK_INTERVAL = 2.0
+# Сколько прошлых версий держать для пользователей, начавших анкету до перезагрузки
+KEEP_VERSIONS = 8
+
+# callback_data кнопок-вариантов: "a:<индекс вопроса>:<индекс варианта>".
+# Старый формат "answer:<индекс вопроса>:<обрезанный текст>" ещё приходит
+# из уже отправленных сообщений и разбирается через legacy-таблицу.
+ANSWER_CALLBACK_PREFIX = 'a'
+LEGACY_ANSWER_CALLBACK_PREFIX = 'answer'
+
+
+def truncate_text(text, max_length=64):
+    encoded_text = text.encode('utf-8')
+    if len(encoded_text) > max_length:
+        truncated_text = encoded_text[:max_length].decode('utf-8', errors='ignore')
+        if len(truncated_text) < len(text):
+            truncated_text = truncated_text[:max_length//2] + "..." + truncated_text[max_length//2+3:]
+        return truncated_text
+    return text
+
+
+def legacy_answer_payload(question_index, text):
+    """Обрезанный текст варианта, как его кодировал старый create_keyboard."""
+    return truncate_text(text, 62 - len(f'{LEGACY_ANSWER_CALLBACK_PREFIX}:{question_index}:'))
+
+
+def _freeze(value):
+    """Рекурсивно заменить списки на кортежи.
+
+    Словари вопросов остаются обычными dict: модель читают только на чтение,
+    а mappingproxy не переживает deepcopy в FSM-хранилище aiogram.
+    """
+    if isinstance(value, dict):
+        return {k: _freeze(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class CompiledQuestionnaire:
+    """Неизменяемая модель анкеты с заранее посчитанными таблицами."""
+
+    __slots__ = (
+        'version', 'questions', 'count', 'next_index', 'prev_index',
+        'brakepoints', 'option_texts', 'option_index', 'has_images',
+        'image_options', 'report_steps', 'legacy_answer_index',
+    )
+
+    def __init__(self, raw_questions, version):
+        questions = _freeze(raw_questions)
+        count = len(questions)
+        skip = [bool(q.get('skip')) for q in questions]
+
+        # next_index[i] — первый не-skip вопрос с индексом >= i (count, если таких нет).
+        # Длина count + 1, чтобы next_index[i + 1] работал и для последнего вопроса.
+        next_index = [count] * (count + 1)
+        for i in range(count - 1, -1, -1):
+            next_index[i] = i if not skip[i] else next_index[i + 1]
+
+        # prev_index[i] — последний не-skip вопрос с индексом <= i (-1, если таких нет)
+        prev_index = [-1] * count
+        last = -1
+        for i in range(count):
+            if not skip[i]:
+                last = i
+            prev_index[i] = last
+
+        option_texts = []
+        option_index = []
+        legacy_answer_index = []
+        has_images = []
+        image_options = []
+        report_steps = []
+        for step, q in enumerate(questions):
+            options = q.get('options', ())
+            texts = tuple(opt['text'] for opt in options)
+            option_texts.append(texts)
+            # При дублях текста берём первый вариант — как прежний next(...) в handle_answer
+            index = {}
+            for i, text in enumerate(texts):
+                index.setdefault(text, i)
+            option_index.append(MappingProxyType(index))
+            legacy = {}
+            for text in texts:
+                legacy.setdefault(legacy_answer_payload(step, text), text)
+            legacy_answer_index.append(MappingProxyType(legacy))
+            images = tuple((i, opt['image']) for i, opt in enumerate(options) if 'image' in opt)
+            image_options.append(images)
+            has_images.append(bool(images))
+            if q.get('key') != 'brakepoint' and not skip[step]:
+                report_steps.append(step)
+
+        set_ = object.__setattr__
+        set_(self, 'version', version)
+        set_(self, 'questions', questions)
+        set_(self, 'count', count)
+        set_(self, 'next_index', tuple(next_index))
+        set_(self, 'prev_index', tuple(prev_index))
+        set_(self, 'brakepoints', frozenset(i for i, q in enumerate(questions) if q.get('key') == 'brakepoint'))
+        set_(self, 'option_texts', tuple(option_texts))
+        set_(self, 'option_index', tuple(option_index))
+        set_(self, 'has_images', tuple(has_images))
+        set_(self, 'image_options', tuple(image_options))
+        set_(self, 'report_steps', tuple(report_steps))
+        set_(self, 'legacy_answer_index', tuple(legacy_answer_index))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompiledQuestionnaire is read-only')
+
+    def __reduce__(self):
+        # Для передачи в пул процессов (сборка отчётов): пересобрать из вопросов
+        return CompiledQuestionnaire, (self.questions, self.version)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.questions[index]
+
+    def is_brakepoint(self, index):
+        return index in self.brakepoints
+
+    def next_question(self, index):
+        """Следующий не-skip вопрос после index (count, если вопросы закончились)."""
+        return self.next_index[min(index + 1, self.count)]
+
+    def prev_question(self, index):
+        """Предыдущий не-skip вопрос до index (-1, если его нет)."""
+        return self.prev_index[index - 1] if index > 0 else -1
+
+    def answer_callback(self, question_index, option_index):
+        return f'{ANSWER_CALLBACK_PREFIX}:{question_index}:{option_index}'
+
+    def decode_answer_callback(self, data):
+        """Разобрать callback_data кнопки-варианта в (индекс вопроса, текст ответа).
+
+        Для старого текстового формата при неизвестном тексте возвращается сам
+        текст из payload (прежнее поведение). None — payload битый.
+        """
+        prefix, _, rest = data.partition(':')
+        question_part, _, payload = rest.partition(':')
+        try:
+            question_index = int(question_part)
+        except ValueError:
+            return None
+        if not 0 <= question_index < self.count:
+            return None
+        if prefix == ANSWER_CALLBACK_PREFIX:
+            try:
+                return question_index, self.option_texts[question_index][int(payload)]
+            except (ValueError, IndexError):
+                return None
+        if prefix == LEGACY_ANSWER_CALLBACK_PREFIX:
+            return question_index, self.legacy_answer_index[question_index].get(payload, payload)
+        return None
+
+    def image_urls(self):
+        """Все URL картинок вариантов без повторов, в порядке анкеты."""
+        seen = {}
+        for images in self.image_options:
+            for _, url in images:
+                seen.setdefault(url, None)
+        return list(seen)
+
+
+def load_questions(path=QUESTIONS_PATH):
+    with open(path, 'rb') as file:
+        raw = file.read()
+    return json.loads(raw.decode('utf-8'))["questions"], raw
+
+
+def compile_questionnaire(path=QUESTIONS_PATH):
+    questions, raw = load_questions(path)
+    version = hashlib.sha1(raw).hexdigest()[:12]
+    return CompiledQuestionnaire(questions, version)
+
+
+_lock = threading.Lock()
+_current = None
+_current_mtime = None
+_last_check = 0.0
+_versions = {}
+
+
+def _file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def reload_questionnaire(path=QUESTIONS_PATH):
+    """Пересобрать модель и атомарно подменить текущую.
+
+    При ошибке разбора остаётся прежняя версия — бот не должен падать из-за
+    опечатки в questions.json на сервере.
+    """
+    global _current, _current_mtime
+    with _lock:
+        mtime = _file_mtime(path)
+        try:
+            model = compile_questionnaire(path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if _current is None:
+                raise
+            logging.error(f"Не удалось перечитать {path}, остаётся версия {_current.version}: {e}")
+            _current_mtime = mtime
+            return _current
+        _versions.pop(model.version, None)
+        _versions[model.version] = model
+        while len(_versions) > KEEP_VERSIONS:
+            _versions.pop(next(iter(_versions)))
+        if _current is None or _current.version != model.version:
+            logging.info(f"Анкета загружена: версия {model.version}, вопросов {model.count}")
+        _current = model
+        _current_mtime = mtime
+        return model
+
+
+def get_questionnaire():
+    """Текущая модель анкеты; перечитывается, если файл изменился."""
+    global _last_check
+    model = _current
+    if model is None:
+        return reload_questionnaire()
+    now = time.monotonic()
+    if now - _last_check >= RELOAD_CHECK_INTERVAL:
+        _last_check = now
+        if _file_mtime(QUESTIONS_PATH) != _current_mtime:
+            model = reload_questionnaire()
+    return model
+
+
+def get_questionnaire_version(version):
+    """Модель конкретной версии (для уже начатых анкет); иначе — текущая."""
+    if version is not None:
+        model = _versions.get(version)
+        if model is not None:
+            return model
+    return get_questionnaire()
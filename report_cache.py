@@ -0,0 +1,111 @@
+"""Кэш собранных DOCX-отчётов по версии данных заявки.
+
+Отчёт зависит только от ответов заявки, полей заявки, которые печатаются в
+заголовке, и версии анкеты. Версия (report_version) складывается из числа
+ответов и максимального id ответа (новый ответ всегда получает больший id,
+удаление уменьшает число), хэша заголовка и версии анкеты. Заявка, её
+версия и запись кэша читаются одним запросом; если версия совпала и файл на
+месте, отчёт не пересобирается, а если Telegram уже выдал file_id, файл не
+загружается заново. Записи лежат в таблице report_cache (общей для всех
+процессов бота) и удаляются вместе с заявкой.
+"""
+import hashlib
+import logging
+import os
+
+from instrumented_pool import query_budget
+
+REPORT_STATE_SQL = """
+    SELECT d.*, a.answers_count, a.answers_max_id,
+           c.version AS cached_version, c.file_path AS cached_path, c.file_id AS cached_file_id
+    FROM data_questions d
+    CROSS JOIN LATERAL (
+        SELECT count(*) AS answers_count, COALESCE(max(id), 0) AS answers_max_id
+        FROM user_answers
+        WHERE id_telegram = d.id_telegram AND request_id = d.id
+    ) a
+    LEFT JOIN report_cache c ON c.request_id = d.id
+    WHERE d.id_telegram = $1 AND d.id = $2
+"""
+STATE_COLUMNS = frozenset(('answers_count', 'answers_max_id', 'cached_version', 'cached_path', 'cached_file_id'))
+# Поля заявки, которые печатаются в отчёте (reports.render_docx)
+HEADER_FIELDS = ('step_start', 'step_time', 'tg_login', 'tg_firstname', 'tg_lastname', 'phone')
+
+
+def report_version(row, questionnaire_version):
+    header = '\x1f'.join(str(row[field]) for field in HEADER_FIELDS)
+    digest = hashlib.sha1(header.encode('utf-8')).hexdigest()[:12]
+    return f"{questionnaire_version}:{row['answers_count']}:{row['answers_max_id']}:{digest}"
+
+
+class ReportState:
+    """Заявка, текущая версия её отчёта и готовый отчёт этой версии (file_path/file_id или None)."""
+
+    __slots__ = ('data_question', 'version', 'file_path', 'file_id')
+
+    def __init__(self, data_question, version, file_path=None, file_id=None):
+        self.data_question = data_question
+        self.version = version
+        self.file_path = file_path
+        self.file_id = file_id
+
+
+class ReportCache:
+    def __init__(self, pool):
+        self.pool = pool
+        self.hits = 0
+        self.misses = 0
+
+    @query_budget(1, name='report_state', label=False)
+    async def state(self, user_id, request_id, questionnaire_version):
+        """ReportState заявки или None, если заявки нет."""
+        async with self.pool.acquire() as connection:
+            row = await connection.fetchrow(REPORT_STATE_SQL, user_id, request_id)
+        if row is None:
+            return None
+        data_question = {key: value for key, value in row.items() if key not in STATE_COLUMNS}
+        state = ReportState(data_question, report_version(row, questionnaire_version))
+        if row['cached_version'] == state.version and os.path.exists(row['cached_path']):
+            state.file_path = row['cached_path']
+            state.file_id = row['cached_file_id']
+            self.hits += 1
+        else:
+            self.misses += 1
+        return state
+
+    @query_budget(1, name='report_cache_store', label=False)
+    async def store(self, request_id, version, file_path):
+        """Запомнить собранный отчёт; file_id прежней версии сбрасывается, её файл удаляется."""
+        try:
+            async with self.pool.acquire() as connection:
+                previous_path = await connection.fetchval("""
+                    WITH previous AS (SELECT file_path FROM report_cache WHERE request_id = $1)
+                    INSERT INTO report_cache (request_id, version, file_path, file_id)
+                    VALUES ($1, $2, $3, NULL)
+                    ON CONFLICT (request_id) DO UPDATE SET
+                        version = EXCLUDED.version, file_path = EXCLUDED.file_path, file_id = NULL,
+                        updated_at = CURRENT_TIMESTAMP
+                    RETURNING (SELECT file_path FROM previous)
+                """, request_id, version, file_path)
+        except Exception as e:
+            # Без записи в кэше отчёт просто соберётся заново при следующем запросе
+            logging.error(f"Ошибка сохранения отчёта {request_id} в кэш: {e}")
+            return
+        # Имя файла зависит от версии — файл прежней версии больше не нужен
+        if previous_path and previous_path != file_path:
+            try:
+                os.remove(previous_path)
+            except OSError:
+                pass
+
+    @query_budget(1, name='report_cache_file_id', label=False)
+    async def remember_file_id(self, request_id, version, file_id):
+        """file_id загруженного отчёта — только если в кэше всё ещё эта версия."""
+        try:
+            async with self.pool.acquire() as connection:
+                await connection.execute("""
+                    UPDATE report_cache SET file_id = $3, updated_at = CURRENT_TIMESTAMP
+                    WHERE request_id = $1 AND version = $2
+                """, request_id, version, file_id)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения file_id отчёта {request_id}: {e}")
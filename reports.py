@@ -0,0 +1,270 @@
+"""Сборка отчётов по заявке: DOCX и текстовый fallback.
+
+Строки заявки и ответов из БД один раз сводятся build_report в Report —
+вопросы отчёта по порядку с выбранными вариантами и своими ответами. Все
+форматы (render_docx, render_text) рисуют из этой модели и не ходят ни в
+БД, ни в анкету. Функции render_* синхронные, а Report — простые объекты со
+__slots__, поэтому сборку можно выполнять в пуле потоков или процессов.
+ReportRenderer запускает их вне event loop, ограничивая число одновременных
+сборок (workers) и длину очереди ожидающих (queue_max).
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+import requests
+from docx import Document
+from docx.shared import Inches
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPORTS_DIR = os.path.join(BASE_DIR, "data_questions")
+
+
+class ReportQueueFull(Exception):
+    """Очередь сборки отчётов переполнена."""
+
+
+# Форматируем даты (PostgreSQL: 2025-06-26 13:50:59.65315+03)
+def fmt_dt(dt):
+    if dt is None:
+        return '—'
+    s = str(dt)[:19]  # YYYY-MM-DD HH:MM:SS
+    try:
+        return datetime.strptime(s, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y %H:%M')
+    except ValueError:
+        return s
+
+
+def report_file_path(data_question, user_id, request_id, suffix, version=None):
+    """Путь к файлу отчёта; в имени — хэш версии (report_cache), без версии — случайная метка.
+
+    Отчёт новой версии или некэшируемый отчёт не перезаписывает файл,
+    на который ещё ссылается кэш.
+    """
+    if not os.path.exists(REPORTS_DIR):
+        os.makedirs(REPORTS_DIR, exist_ok=True)
+    name_part = data_question.get('tg_login') or f"{data_question.get('tg_firstname') or ''} {data_question.get('tg_lastname') or ''}".strip() or 'user'
+    safe_name = "".join(c for c in name_part if c not in r'\/:*?"<>|')[:50]
+    tag = hashlib.sha1(version.encode('utf-8')).hexdigest()[:10] if version else uuid.uuid4().hex[:10]
+    return os.path.join(REPORTS_DIR, f"{safe_name} {user_id} {request_id} {tag}{suffix}")
+
+
+def _save_atomically(file_path, save):
+    """Записать файл во временный и переименовать: параллельная сборка той же версии
+    не оставит недописанный файл."""
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        save(tmp_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return file_path
+
+
+def fetch_image(url, proxies=None, image_cache=None):
+    """Байты картинки варианта (через локальный кэш, если он передан) или None."""
+    if image_cache is not None:
+        return image_cache.get(url, proxies)
+    try:
+        response = requests.get(url, timeout=10, proxies=proxies)
+        response.raise_for_status()
+        return response.content
+    except requests.RequestException as image_error:
+        logging.warning(f"Не удалось загрузить изображение для отчёта: {url} ({image_error})")
+        return None
+
+
+class ReportQuestion:
+    """Вопрос отчёта: выбранные варианты (текст, URL картинки или None) в порядке анкеты и свои ответы."""
+
+    __slots__ = ('number', 'step', 'text', 'selected', 'custom')
+
+    def __init__(self, number, step, text, selected, custom):
+        self.number = number
+        self.step = step
+        self.text = text
+        self.selected = selected
+        self.custom = custom
+
+    @property
+    def answered(self):
+        return bool(self.selected or self.custom)
+
+
+class Report:
+    """Данные отчёта по заявке — общий вход для всех форматов.
+
+    version — ключ кэша отчётов (None — отчёт не кэшируется); file_path и
+    file_id — уже собранный DOCX этой версии и его file_id в Telegram, если они
+    известны (report_cache.py).
+    """
+
+    __slots__ = ('user_id', 'request_id', 'data_question', 'questions', 'version', 'file_path', 'file_id')
+
+    def __init__(self, user_id, request_id, data_question, questions, version=None, file_path=None, file_id=None):
+        self.user_id = user_id
+        self.request_id = request_id
+        self.data_question = data_question
+        self.questions = questions
+        self.version = version
+        self.file_path = file_path
+        self.file_id = file_id
+
+    def image_urls(self):
+        """URL картинок выбранных вариантов — их можно скачать заранее, до сборки."""
+        return [image for question in self.questions for _, image in question.selected if image]
+
+
+def build_report(user_id, request_id, data_question, user_answers, questions, version=None):
+    """Свести строки user_answers в Report за один проход.
+
+    Ответы группируются по шагу; затем каждый вопрос отчёта (без brakepoint и
+    skip) сверяет свои варианты с множеством выбранных текстов — без поиска по
+    всем ответам на каждый вопрос. Свои ответы (answer_type = 'custom') идут в
+    порядке строк (ORDER BY question_step, id).
+    """
+    by_step = {}
+    for answer in user_answers:
+        chosen, custom = by_step.setdefault(answer['question_step'], (set(), []))
+        if answer['answer_type'] == 'custom':
+            custom.append(answer['answer_text'])
+        else:
+            chosen.add(answer['answer_text'])
+
+    report_questions = []
+    for number, step in enumerate(questions.report_steps, 1):
+        question_info = questions[step]
+        chosen, custom = by_step.get(step, ((), ()))
+        selected = tuple(
+            (option['text'], option.get('image'))
+            for option in question_info.get('options', ())
+            if option['text'] in chosen
+        )
+        report_questions.append(ReportQuestion(number, step, question_info['text'], selected, tuple(custom)))
+    return Report(user_id, request_id, dict(data_question), tuple(report_questions), version)
+
+
+def render_docx(report, proxies=None, image_cache=None, images=None):
+    """Собрать DOCX-отчёт и вернуть путь к файлу.
+
+    images — заранее скачанные картинки {url: байты}; если передан, сеть не
+    используется, а отсутствующие в нём картинки пропускаются.
+    """
+    data_question = report.data_question
+    # Создаем документ
+    doc = Document()
+    doc.add_heading('Отчет по опросу', 0)
+
+    step_start = fmt_dt(data_question['step_start'])
+    step_time = fmt_dt(data_question['step_time'])
+
+    # Добавляем данные пользователя и опроса
+    doc.add_paragraph(f"ID заявки: {report.request_id}")
+    doc.add_paragraph(f"Дата начала прохождения опроса: {step_start}")
+    doc.add_paragraph(f"Дата последнего ответа: {step_time}")
+    doc.add_paragraph(f"Логин пользователя: {data_question['tg_login']}")
+    doc.add_paragraph(f"Фамилия и Имя пользователя: {data_question['tg_firstname']} {data_question['tg_lastname']}")
+    doc.add_paragraph(f"Телефон пользователя: {data_question['phone']}")
+
+    # Добавляем ответы пользователя
+    doc.add_heading('Ответы пользователя', level=1)
+
+    # Сквозная нумерация только для вопросов, попадающих в отчёт (без brakepoint и skip)
+    for question in report.questions:
+        doc.add_heading(f"Вопрос {question.number}: {question.text}", level=2)
+
+        for answer_text, image in question.selected:
+            doc.add_paragraph(f"Ответ: {answer_text}")
+
+            # Включаем изображение, если это ответ с изображением.
+            # Ошибка загрузки картинки не должна ломать формирование всего отчёта.
+            if image:
+                if images is not None:
+                    content = images.get(image)
+                else:
+                    content = fetch_image(image, proxies, image_cache)
+                if content is not None:
+                    paragraph = doc.add_paragraph()
+                    run = paragraph.add_run()
+                    try:
+                        run.add_picture(BytesIO(content), width=Inches(1), height=Inches(1))
+                    except Exception as image_insert_error:
+                        logging.warning(f"Не удалось вставить изображение в отчёт: {image} ({image_insert_error})")
+
+        for answer_text in question.custom:
+            doc.add_paragraph(f"Ответ: {answer_text}")
+
+        # Если ответов на текущий вопрос нет
+        if not question.answered:
+            doc.add_paragraph("Пользователь не ответил на этот вопрос.")
+
+    file_path = report_file_path(data_question, report.user_id, report.request_id, ".docx", report.version)
+    return _save_atomically(file_path, doc.save)
+
+
+def render_text(report):
+    """Текстовый fallback-отчёт (если DOCX не собрался)."""
+    lines = []
+    lines.append("Ответы пользователя")
+    lines.append("")
+
+    # Только вопросы с ответами, нумерация — по ним
+    report_question_num = 0
+    for question in report.questions:
+        if not question.answered:
+            continue
+
+        report_question_num += 1
+        lines.append(f"Вопрос {report_question_num}: {question.text}")
+        for answer_text, _ in question.selected:
+            lines.append(f"Ответ: {answer_text}")
+        for answer_text in question.custom:
+            lines.append(f"Ответ: {answer_text}")
+        lines.append("")
+
+    file_path = report_file_path(report.data_question, report.user_id, report.request_id, "_fallback.txt",
+                                 report.version)
+
+    def save(path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+
+    return _save_atomically(file_path, save)
+
+
+class ReportRenderer:
+    """Пул сборки отчётов: thread (по умолчанию) или process."""
+
+    def __init__(self, kind='thread', workers=2, queue_max=20):
+        self.kind = kind
+        self.workers = workers
+        self.queue_max = queue_max
+        if kind == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report')
+        self.in_flight = 0
+
+    @property
+    def queue_depth(self):
+        """Сколько сборок ждут свободного воркера."""
+        return max(self.in_flight - self.workers, 0)
+
+    async def run(self, func, *args):
+        if self.in_flight >= self.workers + self.queue_max:
+            raise ReportQueueFull(f"В очереди уже {self.queue_depth} отчётов")
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
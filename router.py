@@ -0,0 +1,127 @@
+"""Табличная маршрутизация обновлений.
+
+aiogram проверяет обработчики по одному в порядке регистрации: для каждого
+вызывается лямбда-фильтр и (если задан state) читается состояние из
+хранилища. Здесь точные тексты кнопок, команды и callback_data (целиком или
+префикс до первого «:») заранее разложены по словарям с ключом
+(состояние, ключ), поэтому выбор обработчика — один запрос состояния и
+несколько поисков в dict.
+
+Роутер регистрируется в диспетчере первым (install) одним обработчиком на
+сообщения и одним на callback. Если в таблице ничего не нашлось, aiogram
+продолжает проверку обычных обработчиков — универсальные фильтры (ввод
+своего ответа, контакт и т.п.) остаются как есть.
+
+Семантика state та же, что у aiogram: None — пользователь вне состояний,
+'*' — любое состояние; точное состояние проверяется раньше '*'.
+"""
+import inspect
+
+ANY_STATE = '*'
+
+
+def _state_key(state):
+    if state is None or state == ANY_STATE:
+        return state
+    return getattr(state, 'state', state)
+
+
+def _accepts(handler):
+    params = inspect.signature(handler).parameters
+    return 'state' in params or any(p.kind == p.VAR_KEYWORD for p in params.values())
+
+
+class TableRouter:
+    def __init__(self, dp):
+        self.dp = dp
+        self.texts = {}
+        self.texts_lower = {}
+        self.commands = {}
+        self.callbacks = {}
+        self.callback_prefixes = {}
+        self._wants_state = {}
+
+    def _add(self, table, state, key, handler):
+        states = state if isinstance(state, (list, tuple)) else [state]
+        for item in states:
+            table[(_state_key(item), key)] = handler
+        self._wants_state[handler] = _accepts(handler)
+
+    def message_handler(self, text=None, text_lower=None, commands=None, state=None):
+        """Точный текст, текст без учёта регистра или команды (без «/»)."""
+        def decorator(handler):
+            for value in [text] if isinstance(text, str) else text or []:
+                self._add(self.texts, state, value, handler)
+            for value in [text_lower] if isinstance(text_lower, str) else text_lower or []:
+                self._add(self.texts_lower, state, value.lower(), handler)
+            for value in [commands] if isinstance(commands, str) else commands or []:
+                self._add(self.commands, state, value.lower(), handler)
+            return handler
+        return decorator
+
+    def callback_query_handler(self, data=None, prefix=None, state=None):
+        """callback_data целиком или префикс до первого «:» (например, 'nav' для 'nav:next')."""
+        def decorator(handler):
+            for value in [data] if isinstance(data, str) else data or []:
+                self._add(self.callbacks, state, value, handler)
+            for value in [prefix] if isinstance(prefix, str) else prefix or []:
+                self._add(self.callback_prefixes, state, value, handler)
+            return handler
+        return decorator
+
+    @staticmethod
+    def _find(table, state, key):
+        handler = table.get((state, key))
+        if handler is None:
+            handler = table.get((ANY_STATE, key))
+        return handler
+
+    async def _current_state(self, chat_id, user_id):
+        return await self.dp.storage.get_state(chat=chat_id, user=user_id)
+
+    def lookup_message(self, state, message):
+        text = message.text
+        if text is None:
+            return None
+        if text.startswith('/'):
+            command = text.split(maxsplit=1)[0][1:].split('@', 1)[0].lower()
+            handler = self._find(self.commands, state, command)
+            if handler is not None:
+                return handler
+        return self._find(self.texts, state, text) or self._find(self.texts_lower, state, text.lower())
+
+    def lookup_callback(self, state, data):
+        if data is None:
+            return None
+        return self._find(self.callbacks, state, data) or self._find(
+            self.callback_prefixes, state, data.split(':', 1)[0]
+        )
+
+    async def _match_message(self, message):
+        if message.text is None:
+            return False
+        state = await self._current_state(message.chat.id, message.from_user.id)
+        handler = self.lookup_message(state, message)
+        return {'routed': handler} if handler is not None else False
+
+    async def _match_callback(self, callback_query):
+        chat_id = callback_query.message.chat.id if callback_query.message else callback_query.from_user.id
+        state = await self._current_state(chat_id, callback_query.from_user.id)
+        handler = self.lookup_callback(state, callback_query.data)
+        return {'routed': handler} if handler is not None else False
+
+    async def _call(self, event, routed):
+        if self._wants_state[routed]:
+            return await routed(event, state=self.dp.current_state())
+        return await routed(event)
+
+    async def _route_message(self, message, routed):
+        return await self._call(message, routed)
+
+    async def _route_callback(self, callback_query, routed):
+        return await self._call(callback_query, routed)
+
+    def install(self):
+        """Зарегистрировать роутер в диспетчере; вызывать до остальных обработчиков."""
+        self.dp.register_message_handler(self._route_message, self._match_message, state=ANY_STATE)
+        self.dp.register_callback_query_handler(self._route_callback, self._match_callback, state=ANY_STATE)
@@ -0,0 +1,82 @@
+"""Кэш метаданных сессии пользователя: request_id, root, status, last_step.
+
+Эти значения меняются только на /reset, при отправке телефона, при
+завершении анкеты и при переходе между вопросами, а читаются почти на
+каждое нажатие. Кэш — LRU с TTL в памяти процесса; обработчики, меняющие
+значения, явно сбрасывают (invalidate) или обновляют (update) запись.
+"""
+import time
+from collections import OrderedDict
+
+from instrumented_pool import query_budget
+
+SESSION_SQL = """
+    SELECT u.root, u.status, u.last_step,
+           (SELECT id FROM data_questions
+            WHERE id_telegram = $1
+            ORDER BY step_start DESC
+            LIMIT 1) AS request_id
+    FROM (SELECT 1) AS one
+    LEFT JOIN users_designer u ON u.id_telegram = $1
+"""
+
+
+class Session:
+    __slots__ = ('request_id', 'root', 'status', 'last_step', 'loaded_at')
+
+    def __init__(self, request_id=None, root=None, status=None, last_step=None):
+        self.request_id = request_id
+        self.root = root
+        self.status = status
+        self.last_step = last_step
+        self.loaded_at = time.monotonic()
+
+
+class SessionCache:
+    def __init__(self, pool, max_size=10000, ttl=300, before_load=None):
+        self.pool = pool
+        # Вызывается перед чтением из БД (например, сбросить отложенные записи пользователя)
+        self.before_load = before_load
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        return {'size': len(self._sessions), 'hits': self.hits, 'misses': self.misses}
+
+    async def get(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is not None and time.monotonic() - session.loaded_at < self.ttl:
+            self._sessions.move_to_end(user_id)
+            self.hits += 1
+            return session
+        self.misses += 1
+        session = await self._load(user_id)
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+        return session
+
+    @query_budget(2, name='session_load', label=False)
+    async def _load(self, user_id):
+        if self.before_load is not None:
+            await self.before_load(user_id)
+        async with self.pool.acquire() as connection:
+            row = await connection.fetchrow(SESSION_SQL, user_id)
+        return Session(row['request_id'], row['root'], row['status'], row['last_step'])
+
+    def update(self, user_id, **fields):
+        """Поправить закэшированную запись, если она есть (write-through)."""
+        session = self._sessions.get(user_id)
+        if session is not None:
+            for name, value in fields.items():
+                setattr(session, name, value)
+
+    def invalidate(self, user_id):
+        self._sessions.pop(user_id, None)
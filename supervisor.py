@@ -0,0 +1,189 @@
+"""Супервизор: несколько процессов бота, обновления делятся по пользователям.
+
+Супервизор сам получает обновления (getUpdates или webhook) и не ходит в
+БД. Каждое обновление уходит воркеру номер user_id % workers, поэтому все
+нажатия одного пользователя обрабатывает один и тот же процесс и в том же
+порядке. Воркер — обычный main.py с переменными BOT_WORKER_INDEX,
+BOT_WORKER_PORT и BOT_WORKER_SECRET: он слушает 127.0.0.1:порт
+(webhook.run_worker_server), а состояние анкет у всех воркеров общее — в
+PostgreSQL.
+
+В каждый воркер обновления отправляет одна задача, строго по очереди: воркер
+отвечает сразу, не дожидаясь обработки. Упавший воркер перезапускается, а
+недоставленные ему обновления ждут в его очереди. Обновления подтверждаются
+Telegram (offset getUpdates, ответ 200 на webhook) только после того, как
+воркер их принял, поэтому при падении супервизора или воркера Telegram
+доставит их снова.
+
+Лимиты отправки (OUTBOUND_GLOBAL_RATE) у каждого воркера свои, поэтому
+main.py делит общий лимит на BOT_WORKERS.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import sys
+
+import aiohttp
+from aiohttp import web
+
+from webhook import (
+    SECRET_HEADER, make_ssl_context, secret_ok, serve_forever, set_webhook, update_user_id,
+)
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+WORKER_PATH = '/update'
+
+
+def shard_for_user(user_id, workers):
+    """Номер воркера для пользователя; обновления без автора — воркеру 0."""
+    if user_id is None:
+        return 0
+    return user_id % workers
+
+
+class Supervisor:
+    def __init__(self, workers, base_port=8700, command=None, secret=None, restart_delay=1.0):
+        self.workers = workers
+        self.base_port = base_port
+        self.command = command or [sys.executable, MAIN_PATH]
+        self.secret = secret or secrets.token_urlsafe(24)
+        self.restart_delay = restart_delay
+        self.forwarded = [0] * workers
+        self._processes = [None] * workers
+        self._queues = []
+        self._tasks = []
+        self._session = None
+        self._stopping = False
+
+    def worker_env(self, index):
+        env = os.environ.copy()
+        env.update(
+            BOT_WORKERS=str(self.workers),
+            BOT_WORKER_INDEX=str(index),
+            BOT_WORKER_PORT=str(self.base_port + index),
+            BOT_WORKER_SECRET=self.secret,
+        )
+        return env
+
+    def queue_depths(self):
+        return [queue.qsize() for queue in self._queues]
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        loop = asyncio.get_running_loop()
+        for index in range(self.workers):
+            self._tasks.append(loop.create_task(self._keep_running(index)))
+            self._tasks.append(loop.create_task(self._sender(index)))
+        logging.info(f"Запущено воркеров: {self.workers} (порты {self.base_port}..{self.base_port + self.workers - 1})")
+
+    async def _keep_running(self, index):
+        while not self._stopping:
+            process = await asyncio.create_subprocess_exec(*self.command, env=self.worker_env(index))
+            self._processes[index] = process
+            code = await process.wait()
+            if self._stopping:
+                return
+            logging.error(f"Воркер {index} завершился с кодом {code}, перезапуск через {self.restart_delay} с")
+            await asyncio.sleep(self.restart_delay)
+
+    def dispatch(self, update):
+        """Поставить сырое обновление (dict) в очередь его воркера.
+
+        Возвращает future, который завершается, когда воркер принял обновление.
+        """
+        index = shard_for_user(update_user_id(update), self.workers)
+        accepted = asyncio.get_running_loop().create_future()
+        self._queues[index].put_nowait((update, accepted))
+        return accepted
+
+    async def _sender(self, index):
+        url = f'http://127.0.0.1:{self.base_port + index}{WORKER_PATH}'
+        headers = {SECRET_HEADER: self.secret}
+        queue = self._queues[index]
+        while True:
+            update, accepted = await queue.get()
+            delay = 0.1
+            while True:
+                try:
+                    async with self._session.post(url, json=update, headers=headers) as response:
+                        if response.status < 500:
+                            if response.status != 200:
+                                logging.error(f"Воркер {index} отклонил обновление {update.get('update_id')}: {response.status}")
+                            break
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+                # Воркер ещё запускается или перезапускается — ждём, порядок не теряем
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 2.0)
+            self.forwarded[index] += 1
+            if not accepted.done():
+                accepted.set_result(None)
+
+    async def poll(self, bot, timeout=20):
+        """Получать обновления через getUpdates и раздавать воркерам."""
+        await bot.delete_webhook()
+        offset = None
+        while True:
+            try:
+                params = {'timeout': timeout}
+                if offset is not None:
+                    params['offset'] = offset
+                updates = await bot.request('getUpdates', params)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(5)
+                continue
+            # offset подтверждает обновления Telegram — сдвигаем его, только когда
+            # воркеры приняли всю пачку, иначе упавший процесс их потеряет
+            await asyncio.gather(*(self.dispatch(update) for update in updates))
+            if updates:
+                offset = updates[-1]['update_id'] + 1
+
+    async def run_webhook(self, bot, url, path, host, port, secret=None, ssl_cert=None, ssl_key=None):
+        """Принимать webhook от Telegram и раздавать обновления воркерам."""
+        async def handle(request):
+            if not secret_ok(request, secret):
+                return web.Response(status=403)
+            try:
+                accepted = self.dispatch(await request.json())
+            except ValueError:
+                return web.Response(status=400)
+            # Без 200 Telegram повторит доставку — отвечаем, когда воркер принял обновление
+            await accepted
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(path, handle)
+        ssl_context = make_ssl_context(ssl_cert, ssl_key)
+
+        async def on_started():
+            await set_webhook(bot, url, path, secret, 100, ssl_cert if ssl_context else None)
+
+        await serve_forever(app, host, port, ssl_context, on_started)
+
+    async def stop(self, timeout=15):
+        # Даём очередям опустеть, затем просим воркеров завершиться (они дописывают журналы)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while any(self.queue_depths()) and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for process in self._processes:
+            if process is not None and process.returncode is None:
+                process.terminate()
+        for process in self._processes:
+            if process is None:
+                continue
+            try:
+                await asyncio.wait_for(process.wait(), max(deadline - loop.time(), 1))
+            except asyncio.TimeoutError:
+                process.kill()
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,89 @@
+"""Кэш и отложенная запись CachedStorage на бэкенде в памяти.
+
+    python -m unittest discover tests
+"""
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fsm_storage import CachedStorage  # noqa: E402
+
+
+class MemoryBackendStorage(CachedStorage):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.rows = {}
+        self.fail_save = False
+        self.save_gate = None
+        self.deleted = []
+
+    async def _load(self, keys):
+        return {key: self.rows[key] for key in keys if key in self.rows}
+
+    async def _save(self, records):
+        if self.save_gate is not None:
+            await self.save_gate.wait()
+        if self.fail_save:
+            raise ConnectionError('backend down')
+        for key, state, raw in records:
+            self.rows[key] = (state, raw)
+
+    async def _delete(self, keys):
+        self.deleted.extend(keys)
+        for key in keys:
+            self.rows.pop(key, None)
+
+
+class CachedStorageTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        self.storage.fail_save = False
+        await self.storage.close()
+
+    async def test_failed_save_with_full_cache_keeps_state(self):
+        self.storage = MemoryBackendStorage(cache_size=2, flush_interval=60)
+        await self.storage.set_state(chat=1, user=1, state='Questionnaire:asking')
+        await self.storage.update_data(chat=1, user=1, current_question_index=3)
+        await self.storage.flush()
+
+        await self.storage.update_data(chat=1, user=1, current_question_index=4)
+        self.storage.fail_save = True
+        self.storage.save_gate = asyncio.Event()
+        flush = asyncio.ensure_future(self.storage.flush())
+        await asyncio.sleep(0)
+        # Пока запись висит, кэш переполняется другими пользователями; затем запись падает
+        for user in range(2, 6):
+            await self.storage.get_state(chat=user, user=user)
+        self.storage.save_gate.set()
+        with self.assertRaises(ConnectionError):
+            await flush
+        self.storage.save_gate = None
+
+        self.storage.fail_save = False
+        await self.storage.flush()
+        self.assertEqual(self.storage.deleted, [])
+        self.assertEqual(self.storage.rows[(1, 1)][0], 'Questionnaire:asking')
+        self.assertEqual(await self.storage.get_data(chat=1, user=1), {'current_question_index': 4})
+
+    async def test_reset_deletes_persisted_state(self):
+        self.storage = MemoryBackendStorage(flush_interval=60)
+        await self.storage.set_state(chat=1, user=1, state='Questionnaire:asking')
+        await self.storage.flush()
+        await self.storage.reset_state(chat=1, user=1)
+        await self.storage.flush()
+        self.assertEqual(self.storage.deleted, [(1, 1)])
+        self.assertNotIn((1, 1), self.storage.rows)
+
+    async def test_shared_backend_writes_through(self):
+        self.storage = MemoryBackendStorage(flush_interval=60, exclusive=False)
+        await self.storage.set_state(chat=1, user=1, state='Questionnaire:asking')
+        self.assertEqual(self.storage.rows[(1, 1)][0], 'Questionnaire:asking')
+        # Другой процесс изменил состояние — без кэша чтения оно видно сразу
+        self.storage.rows[(1, 1)] = ('Form:waiting_for_phone', '{}')
+        self.assertEqual(await self.storage.get_state(chat=1, user=1), 'Form:waiting_for_phone')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+"""Иерархическое колесо таймеров для таймаутов бездействия.
+
+Вместо отдельной asyncio-задачи со sleep на каждого пользователя — одна
+фоновая задача, которая раз в tick секунд проворачивает колесо.
+Постановка, перепостановка и отмена таймера — O(1): запись лежит в словаре
+своего слота, а положение ключа запоминается в _where.
+
+PersistentTimers дополнительно хранит сроки в PostgreSQL (отложенной
+пакетной записью), поэтому после перезапуска просроченные таймеры
+срабатывают, а остальные продолжают отсчёт.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+
+class TimingWheel:
+    """Колесо с levels уровнями по slots слотов; уровень L покрывает slots**(L+1) тиков."""
+
+    def __init__(self, on_expire, tick=1.0, slots=64, levels=4):
+        self.on_expire = on_expire
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._spans = [slots ** level for level in range(levels + 1)]
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._where = {}
+        self._now = self._tick_of(time.time())
+        self._task = None
+
+    def _tick_of(self, timestamp):
+        return int(timestamp // self.tick)
+
+    def __len__(self):
+        return len(self._where)
+
+    @property
+    def pending(self):
+        """Сколько таймеров сейчас ждут срабатывания."""
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _place(self, key, deadline_tick, payload, cascading=False):
+        delta = deadline_tick - self._now
+        # При каскаде текущий тик ещё не обработан, поэтому срок «сейчас» допустим;
+        # иначе просроченный таймер сработает на ближайшем тике
+        if delta < 0 or (delta == 0 and not cascading):
+            deadline_tick = self._now + 1
+            delta = 1
+        level = 0
+        while level < self.levels - 1 and delta >= self._spans[level + 1]:
+            level += 1
+        slot = (deadline_tick // self._spans[level]) % self.slots
+        self._wheels[level][slot][key] = (deadline_tick, payload)
+        self._where[key] = (level, slot)
+
+    def arm(self, key, deadline, payload=None):
+        """Поставить (или переставить) таймер key на момент deadline (unix time)."""
+        self.cancel(key)
+        self._place(key, self._tick_of(deadline), payload)
+
+    def cancel(self, key):
+        where = self._where.pop(key, None)
+        if where is None:
+            return False
+        level, slot = where
+        self._wheels[level][slot].pop(key, None)
+        return True
+
+    def deadline(self, key):
+        where = self._where.get(key)
+        if where is None:
+            return None
+        level, slot = where
+        return self._wheels[level][slot][key][0] * self.tick
+
+    def _advance(self):
+        """Провернуть колесо на один тик и вернуть сработавшие (key, payload)."""
+        self._now += 1
+        # Каскад: когда младшие уровни сделали полный оборот, раскладываем слот старшего уровня
+        for level in range(1, self.levels):
+            if self._now % self._spans[level]:
+                break
+            slot = (self._now // self._spans[level]) % self.slots
+            bucket, self._wheels[level][slot] = self._wheels[level][slot], {}
+            for key, (deadline_tick, payload) in bucket.items():
+                del self._where[key]
+                self._place(key, deadline_tick, payload, cascading=True)
+        slot = self._now % self.slots
+        bucket, self._wheels[0][slot] = self._wheels[0][slot], {}
+        expired = []
+        for key, (deadline_tick, payload) in bucket.items():
+            del self._where[key]
+            if deadline_tick <= self._now:
+                expired.append((key, payload))
+            else:
+                self._place(key, deadline_tick, payload)
+        return expired
+
+    def advance_to(self, timestamp):
+        expired = []
+        target = self._tick_of(timestamp)
+        while self._now < target:
+            expired.extend(self._advance())
+        return expired
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(max((self._now + 1) * self.tick - time.time(), 0))
+            for key, payload in self.advance_to(time.time()):
+                self._on_expired(key)
+                loop.create_task(self._fire(key, payload))
+
+    def _on_expired(self, key):
+        pass
+
+    async def _fire(self, key, payload):
+        try:
+            await self.on_expire(key, payload)
+        except Exception:
+            logging.exception(f"Ошибка обработчика таймера {key}")
+
+
+class PersistentTimers(TimingWheel):
+    """Колесо, чьи сроки сохраняются в таблице inactivity_timers.
+
+    Ключ — Telegram ID пользователя, payload — (chat_id, message_id) сообщения
+    с вопросом. Изменения пишутся пачкой раз в flush_interval секунд.
+    """
+
+    def __init__(self, pool, on_expire, flush_interval=5.0, **kwargs):
+        super().__init__(on_expire, **kwargs)
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self._dirty = set()
+        self._flush_task = None
+
+    async def load(self, owns=None):
+        """Поднять сохранённые таймеры после перезапуска.
+
+        owns(id_telegram) — фильтр для воркера, которому принадлежит часть пользователей.
+        """
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch("SELECT id_telegram, chat_id, message_id, deadline FROM inactivity_timers")
+        if owns is not None:
+            rows = [row for row in rows if owns(row['id_telegram'])]
+        for row in rows:
+            super().arm(row['id_telegram'], row['deadline'].timestamp(), (row['chat_id'], row['message_id']))
+        if rows:
+            logging.info(f"Восстановлено таймеров бездействия: {len(rows)}")
+
+    def arm(self, key, deadline, payload=None):
+        super().arm(key, deadline, payload)
+        self._dirty.add(key)
+
+    def cancel(self, key):
+        cancelled = super().cancel(key)
+        if cancelled:
+            self._dirty.add(key)
+        return cancelled
+
+    def _on_expired(self, key):
+        self._dirty.add(key)
+
+    def start(self):
+        super().start()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flusher())
+
+    async def stop(self):
+        await super().stop()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка сохранения таймеров бездействия: {e}")
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key in keys:
+            where = self._where.get(key)
+            if where is None:
+                deletes.append(key)
+                continue
+            level, slot = where
+            deadline_tick, (chat_id, message_id) = self._wheels[level][slot][key]
+            deadline = datetime.fromtimestamp(deadline_tick * self.tick, tz=timezone.utc)
+            upserts.append((key, chat_id, message_id, deadline))
+        try:
+            async with self.pool.acquire() as connection:
+                if upserts:
+                    await connection.executemany(
+                        """
+                        INSERT INTO inactivity_timers (id_telegram, chat_id, message_id, deadline)
+                        VALUES ($1, $2, $3, $4)
+                        ON CONFLICT (id_telegram) DO UPDATE
+                        SET chat_id = EXCLUDED.chat_id, message_id = EXCLUDED.message_id, deadline = EXCLUDED.deadline
+                        """,
+                        upserts
+                    )
+                if deletes:
+                    await connection.execute(
+                        "DELETE FROM inactivity_timers WHERE id_telegram = ANY($1::bigint[])",
+                        deletes
+                    )
+        except Exception:
+            self._dirty |= keys
+            raise
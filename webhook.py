@@ -0,0 +1,152 @@
+"""Приём обновлений через webhook (aiohttp) вместо long polling.
+
+Telegram присылает обновление POST-запросом на WEBHOOK_PATH; запрос без
+верного заголовка X-Telegram-Bot-Api-Secret-Token отклоняется (403).
+Обновление сразу подтверждается ответом 200, а обрабатывается в фоновой
+задаче. Одновременно обрабатывается не больше max_concurrency обновлений:
+если все слоты заняты, ответ Telegram задерживается до освобождения слота,
+и Telegram сам притормаживает доставку. Обновления одного пользователя
+обрабатываются строго по очереди: слот берётся уже под блокировкой
+пользователя, так что серия его обновлений занимает один слот, а не все.
+
+Варианты запуска:
+  * за обратным прокси (nginx и т.п.) — бот слушает обычный HTTP,
+    TLS завершается на прокси;
+  * напрямую с самоподписанным сертификатом — WEBHOOK_SSL_CERT и
+    WEBHOOK_SSL_KEY; сертификат передаётся Telegram в setWebhook.
+
+Тот же сервер без setWebhook принимает обновления от супервизора
+(run_worker_server, см. supervisor.py).
+"""
+import asyncio
+import hmac
+import logging
+import ssl
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def update_user_id(data):
+    """Telegram ID автора обновления (сырой dict) или None."""
+    for key, value in data.items():
+        if key != 'update_id' and isinstance(value, dict):
+            sender = value.get('from') or value.get('user')
+            if sender:
+                return sender.get('id')
+    return None
+
+
+def secret_ok(request, secret):
+    return not secret or hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), secret)
+
+
+class WebhookServer:
+    def __init__(self, dp, path='/telegram/webhook', secret=None, max_concurrency=64):
+        self.dp = dp
+        self.path = path
+        self.secret = secret
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+        # user_id -> [lock, число ожидающих обновлений]
+        self._users = {}
+        self.processed = 0
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle)
+
+    @property
+    def in_flight(self):
+        return len(self._tasks)
+
+    async def handle(self, request):
+        if not secret_ok(request, self.secret):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            update = types.Update(**data)
+        except ValueError:
+            return web.Response(status=400)
+        if self._slots.locked():
+            # Все слоты заняты — не отвечаем Telegram, пока какой-нибудь не освободится
+            async with self._slots:
+                pass
+        task = asyncio.get_running_loop().create_task(self._process(update, update_user_id(data)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update, user_id):
+        Dispatcher.set_current(self.dp)
+        Bot.set_current(self.dp.bot)
+        entry = self._users.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await self.dp.process_update(update)
+                self.processed += 1
+        except Exception:
+            logging.exception(f"Ошибка обработки обновления {update.update_id}")
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._users[user_id]
+
+    async def drain(self, timeout=10):
+        """Дождаться обновлений, которые уже в обработке."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+async def serve_forever(app, host, port, ssl_context=None, on_started=None, on_stopping=None):
+    """Запустить aiohttp-приложение и держать его до отмены."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, ssl_context=ssl_context)
+    await site.start()
+    try:
+        if on_started is not None:
+            await on_started()
+        await asyncio.Event().wait()
+    finally:
+        await runner.shutdown()
+        if on_stopping is not None:
+            await on_stopping()
+        await runner.cleanup()
+
+
+def make_ssl_context(ssl_cert=None, ssl_key=None):
+    if not (ssl_cert and ssl_key):
+        return None
+    ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ssl_context.load_cert_chain(ssl_cert, ssl_key)
+    return ssl_context
+
+
+async def set_webhook(bot, url, path, secret=None, max_connections=64, ssl_cert=None):
+    certificate = types.InputFile(ssl_cert) if ssl_cert else None
+    await bot.set_webhook(
+        url.rstrip('/') + path, certificate=certificate,
+        max_connections=min(max_connections, 100), secret_token=secret
+    )
+    logging.info(f"Webhook {url.rstrip('/')}{path}")
+
+
+async def run_webhook(dp, url, path, host, port, secret=None, max_concurrency=64,
+                      ssl_cert=None, ssl_key=None):
+    """Зарегистрировать webhook и обслуживать его до отмены."""
+    server = WebhookServer(dp, path, secret, max_concurrency)
+    ssl_context = make_ssl_context(ssl_cert, ssl_key)
+
+    async def on_started():
+        await set_webhook(dp.bot, url, path, secret, max_concurrency, ssl_cert if ssl_context else None)
+        logging.info(f"Слушаем {host}:{port}")
+
+    await serve_forever(server.app, host, port, ssl_context, on_started, server.drain)
+
+
+async def run_worker_server(dp, port, secret, path='/update', max_concurrency=64):
+    """Воркер супервизора: принимать обновления на 127.0.0.1:port, без setWebhook."""
+    server = WebhookServer(dp, path, secret, max_concurrency)
+    await serve_forever(server.app, '127.0.0.1', port, on_stopping=server.drain)